@@ -0,0 +1,280 @@
+import json
+import logging
+import re
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import date
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import database
+
+# Local JSON API for tills sharing one store.db. Tills keep their own copy of
+# the catalog and sync it with /stock instead of re-reading it, and send
+# their checkouts here, where they join the same writer queue as the POS page.
+#
+#   GET  /catalog            whole catalog; the ETag is the catalog version (304 if unchanged)
+#   GET  /stock?since=N      products changed or deleted after catalog version N
+#   POST /checkout           {"orders": [{"cart": [...], "total": n, "camper_name": s, "session_id": s}]}
+#   GET  /orders             keyset page: before_id, limit, from, to, camper, archived=1
+#   GET  /orders/<id>        one order with its items; archived=1 looks in the archives too
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_BODY_BYTES = 1024 * 1024
+MAX_CHECKOUT_ORDERS = 200  # per request; the writer commits them in CHECKOUT_BATCH_MAX batches
+MAX_ORDERS_PAGE = 500
+CHECKOUT_TIMEOUT = 120  # seconds to wait for the checkout writer
+SQLITE_INT_MAX = 2 ** 63 - 1
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _etag(version):
+    return f'"{version}"'
+
+def _etag_matches(header, version):
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == _etag(version) for tag in tags)
+
+def _int_param(query, name, default=None, minimum=None, maximum=None):
+    values = query.get(name)
+    if not values:
+        return default
+    try:
+        value = int(values[-1])
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"{name} must be an integer")
+    if abs(value) > SQLITE_INT_MAX:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"{name} is out of range")
+    if minimum is not None and value < minimum:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"{name} must be at least {minimum}")
+    return min(value, maximum) if maximum is not None else value
+
+def _date_param(query, name):
+    values = query.get(name)
+    if not values:
+        return None
+    try:
+        return date.fromisoformat(values[-1])
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"{name} must be a YYYY-MM-DD date")
+
+def _flag_param(query, name):
+    return (query.get(name) or ["0"])[-1].lower() in ("1", "true", "yes")
+
+def _cart_from_json(cart, position):
+    if not isinstance(cart, list) or not cart:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"orders[{position}].cart must be a non-empty list")
+    lines = []
+    for line in cart:
+        if not isinstance(line, dict) or any(key not in line for key in ("id", "name", "price", "quantity")):
+            raise ApiError(HTTPStatus.BAD_REQUEST,
+                           f"orders[{position}].cart lines need id, name, price and quantity")
+        try:
+            lines.append({
+                "id": int(line["id"]),
+                "name": str(line["name"]),
+                "size": str(line.get("size") or ""),
+                "price": line["price"],
+                "quantity": int(line["quantity"]),
+            })
+        except (TypeError, ValueError):
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"orders[{position}].cart has a non-numeric id or quantity")
+        if lines[-1]["quantity"] <= 0 or not isinstance(lines[-1]["price"], (int, float)):
+            raise ApiError(HTTPStatus.BAD_REQUEST,
+                           f"orders[{position}].cart needs positive quantities and numeric prices")
+        if not (0 < lines[-1]["id"] <= SQLITE_INT_MAX and lines[-1]["quantity"] <= SQLITE_INT_MAX):
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"orders[{position}].cart has an id or quantity out of range")
+    return lines
+
+def _optional_text(order, key, position):
+    value = order.get(key)
+    if value is not None and not isinstance(value, str):
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"orders[{position}].{key} must be a string or null")
+    return value
+
+def _rejected_cart(cart, session_id):
+    # The same check the POS page runs before queueing: every product still exists at the
+    # price the till charged. Stock is left to the writer, which checks it atomically.
+    errors = [
+        error for error in database.validate_cart(cart, session_id=session_id)["errors"]
+        if error["code"] in ("missing", "price_changed")
+    ]
+    if not errors:
+        return None
+    code = "missing" if any(error["code"] == "missing" for error in errors) else "price_changed"
+    return {"error": "; ".join(error["message"] for error in errors), "code": code, "errors": errors}
+
+def _checkout_result(future):
+    try:
+        return {"order_id": future.result(timeout=CHECKOUT_TIMEOUT)}
+    except database.InsufficientStockError as e:
+        return {"error": str(e), "code": "insufficient_stock", "shortages": e.shortages}
+    except FutureTimeoutError:
+        # Still queued; it may yet commit, so the till should look it up before retrying
+        return {"error": "Checkout is still queued", "code": "timeout"}
+    except ValueError as e:
+        return {"error": str(e), "code": "invalid"}
+    except Exception as e:
+        return {"error": str(e), "code": "failed"}
+
+class StoreRequestHandler(BaseHTTPRequestHandler):
+    server_version = "StorePOS/1"
+    protocol_version = "HTTP/1.1"  # keep-alive for tills that sync often
+
+    def do_GET(self):
+        self._dispatch(self.GET_ROUTES)
+
+    def do_POST(self):
+        self._dispatch(self.POST_ROUTES)
+
+    def _dispatch(self, routes):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        try:
+            for pattern, handler in routes:
+                match = pattern.fullmatch(url.path.rstrip("/") or "/")
+                if match:
+                    handler(self, query, *match.groups())
+                    return
+            known = any(pattern.fullmatch(url.path.rstrip("/") or "/")
+                        for pattern, _ in self.GET_ROUTES + self.POST_ROUTES)
+            if known:
+                raise ApiError(HTTPStatus.METHOD_NOT_ALLOWED, f"{self.command} is not supported on {url.path}")
+            raise ApiError(HTTPStatus.NOT_FOUND, f"No such endpoint: {url.path}")
+        except ApiError as e:
+            self._send_json({"error": str(e)}, status=e.status)
+        except Exception as e:
+            logging.error(f"API request {self.command} {self.path} failed: {str(e)}")
+            self._send_json({"error": "Internal error"}, status=HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    def _send_json(self, payload, status=HTTPStatus.OK, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status >= 400:
+            # A rejected request's body may be unread, so don't reuse the connection
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise ApiError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"Request body is over {MAX_BODY_BYTES} bytes")
+        try:
+            return json.loads(self.rfile.read(length) or b"null")
+        except ValueError:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Request body is not valid JSON")
+
+    def get_catalog(self, query):
+        # Served from the process-wide catalog cache; version and products come from one snapshot
+        catalog = database.get_catalog()
+        headers = {"ETag": _etag(catalog["version"]), "Cache-Control": "no-cache"}
+        if _etag_matches(self.headers.get("If-None-Match"), catalog["version"]):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self._send_json({"version": catalog["version"], "products": catalog["products"]}, headers=headers)
+
+    def get_stock(self, query):
+        since = _int_param(query, "since", minimum=0)
+        if since is None:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "since is required")
+        self._send_json(database.get_product_changes(since))
+
+    def post_checkout(self, query):
+        payload = self._read_json()
+        orders = payload.get("orders") if isinstance(payload, dict) else None
+        if not isinstance(orders, list) or not orders:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "orders must be a non-empty list")
+        if len(orders) > MAX_CHECKOUT_ORDERS:
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"At most {MAX_CHECKOUT_ORDERS} orders per request")
+        jobs = []
+        for position, order in enumerate(orders):
+            if not isinstance(order, dict):
+                raise ApiError(HTTPStatus.BAD_REQUEST, f"orders[{position}] must be an object")
+            cart = _cart_from_json(order.get("cart"), position)
+            items_total = sum(line["price"] * line["quantity"] for line in cart)
+            total = order.get("total", items_total)
+            if not isinstance(total, (int, float)):
+                raise ApiError(HTTPStatus.BAD_REQUEST, f"orders[{position}].total must be a number")
+            jobs.append((cart, total, items_total, _optional_text(order, "camper_name", position),
+                         _optional_text(order, "session_id", position)))
+        rejections = []
+        for cart, total, items_total, _, session_id in jobs:
+            rejected = _rejected_cart(cart, session_id)
+            if rejected is None and total != items_total:
+                rejected = {"error": f"Total {total} doesn't match the cart's {items_total}", "code": "total_mismatch"}
+            rejections.append(rejected)
+        # The accepted orders are queued together, so the writer commits them in as few
+        # transactions as it can; rejected ones keep their error in place
+        futures = [
+            None if rejected else database.submit_order(cart, total, camper_name=camper_name, session_id=session_id)
+            for (cart, total, _, camper_name, session_id), rejected in zip(jobs, rejections)
+        ]
+        results = [rejected or _checkout_result(future) for future, rejected in zip(futures, rejections)]
+        self._send_json({"results": results, "version": database.get_catalog_version()})
+
+    def get_orders(self, query):
+        orders, next_before_id = database.get_orders_page(
+            limit=_int_param(query, "limit", database.ORDER_PAGE_SIZE, minimum=1, maximum=MAX_ORDERS_PAGE),
+            before_id=_int_param(query, "before_id"),
+            start_date=_date_param(query, "from"),
+            end_date=_date_param(query, "to"),
+            camper_name=(query.get("camper") or [None])[-1],
+            include_archived=_flag_param(query, "archived"),
+        )
+        self._send_json({"orders": orders, "next_before_id": next_before_id})
+
+    def get_order(self, query, order_id):
+        order = None
+        if int(order_id) <= SQLITE_INT_MAX:
+            order = database.get_order(int(order_id), include_archived=_flag_param(query, "archived"))
+        if order is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, f"Order {order_id} not found")
+        self._send_json(order)
+
+    GET_ROUTES = [
+        (re.compile(r"/catalog"), get_catalog),
+        (re.compile(r"/stock"), get_stock),
+        (re.compile(r"/orders"), get_orders),
+        (re.compile(r"/orders/(\d+)"), get_order),
+    ]
+    POST_ROUTES = [
+        (re.compile(r"/checkout"), post_checkout),
+    ]
+
+    def log_message(self, format, *args):
+        logging.info(f"API {self.address_string()} {format % args}")
+
+def make_server(host=DEFAULT_HOST, port=DEFAULT_PORT, db_path=None):
+    # Binds the API to db_path (default database.DB_NAME); port 0 picks a free
+    # port, readable from server.server_address. Call serve_forever() to run it.
+    if db_path is not None:
+        database.DB_NAME = db_path
+    database.init_db()
+    return ThreadingHTTPServer((host, port), StoreRequestHandler)
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, db_path=None):
+    server = make_server(host, port, db_path)
+    logging.info(f"API listening on http://{server.server_address[0]}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
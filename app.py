@@ -1,9 +1,22 @@
+import time
+RENDER_STARTED = time.perf_counter()  # read before the store modules load, so a cold render counts them
 import streamlit as st
-import pandas as pd
 import os
-import time
+import uuid
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import datetime
-from database import init_db, get_products, save_order, get_connection
+import instrumentation
+from database import (
+    InsufficientStockError,
+    get_catalog,
+    init_db,
+    release_holds,
+    reserve_stock,
+    submit_order,
+    validate_cart,
+)
+from catalog_search import catalog_facets, search_catalog
+from images import product_thumbnail
 
 # Set page config with dark theme
 st.set_page_config(
@@ -91,148 +104,153 @@ st.markdown(
 st.title("🛍️ Products")
 
 # ------------------ Init ------------------ #
+CHECKOUT_TIMEOUT = 120  # seconds to wait for the checkout writer
+PRODUCTS_PER_PAGE = 24  # product cards rendered per grid page
 init_db()
 if "cart" not in st.session_state:
     st.session_state.cart = {}
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex  # owner of this till's stock holds
 if "checkout_in_progress" not in st.session_state:
     st.session_state.checkout_in_progress = False
+if "pending_checkout" not in st.session_state:
+    st.session_state.pending_checkout = None  # a timed-out checkout still in the writer queue
 if "warnings" not in st.session_state:
     st.session_state.warnings = {}
-if "quantities" not in st.session_state:
-    st.session_state.quantities = {}
+if "card_notices" not in st.session_state:
+    st.session_state.card_notices = {}
 
 def reload_products():
     try:
-        products = get_products()
-        return products if products else []
+        # Served from the process-wide cache unless the catalog version moved
+        return get_catalog()
     except Exception as e:
         st.error(f"Error loading products: {str(e)}")
-        return []
-
-products = reload_products()
-
-# ------------------ Group by Product Name ------------------ #
-grouped = {}
-for p in products:
-    grouped.setdefault(p["name"], []).append(p)
-
-# ------------------ Helper: Render Size and Quantity Dropdowns ------------------ #
-def render_size_quantities(name, variants):
-    available_variants = [v for v in variants if v["quantity"] > 0]
-    has_sizes = len(set(v["size"] for v in variants)) > 1
-    
-    if has_sizes:
-        all_sizes = sorted(set(v["size"] for v in variants))
-        available_sizes = sorted(set(v["size"] for v in available_variants))
-        session_key = f"selected_size_{name}"
-        qty_key_prefix = f"qty_{name}_"
+        return {"db_name": None, "version": None, "products": [], "grouped": {}, "views": []}
 
-        # Initialize selected size
-        if session_key not in st.session_state:
-            st.session_state[session_key] = available_sizes[0] if available_sizes else None
+catalog = reload_products()
+products = catalog["products"]
 
-        # Use columns to place size and quantity side by side
-        col1, col2 = st.columns(2)
+# ------------------ Product Card ------------------ #
+@st.fragment
+def product_card(view):
+    # A fragment, so picking a size or quantity reruns this card only
+    name = view["name"]
+    st.markdown(f"<div class='product-card'><h3 class='product-title'>{name}</h3>", unsafe_allow_html=True)
+    st.image(product_thumbnail(name))
+    available_sizes = view["available_sizes"]
+    col1, col2 = st.columns(2)
+    if view["has_sizes"]:
         with col1:
-            # Size dropdown
-            selected_size = st.selectbox("Size:", available_sizes, index=available_sizes.index(st.session_state[session_key]) if st.session_state[session_key] in available_sizes else 0, key=f"size_select_{name}")
-            if selected_size != st.session_state[session_key]:
-                st.session_state[session_key] = selected_size
-                # Clear previous quantity
-                for key in list(st.session_state.quantities.keys()):
-                    if key.startswith(qty_key_prefix):
-                        del st.session_state.quantities[key]
-                st.rerun()
-
-        with col2:
-            # Quantity dropdown for selected size
-            if st.session_state[session_key] and st.session_state[session_key] in available_sizes:
-                variant = next(v for v in variants if v["size"] == st.session_state[session_key])
-                qty_key = f"qty_{name}_{st.session_state[session_key]}"
-                if qty_key not in st.session_state.quantities:
-                    st.session_state.quantities[qty_key] = 1
-                
-                quantities = list(range(1, variant["quantity"] + 1))
-                selected_qty = st.selectbox("Qty:", quantities, index=quantities.index(st.session_state.quantities[qty_key]) if st.session_state.quantities[qty_key] in quantities else 0, key=f"qty_select_{name}_{st.session_state[session_key]}")
-                st.session_state.quantities[qty_key] = selected_qty
+            selected_size = st.selectbox("Size:", available_sizes, key=f"size_select_{name}") if available_sizes else None
+        selected_variant = view["variant_by_size"].get(selected_size)
+        stock = view["stock_by_size"].get(selected_size, view["total_stock"])
     else:
-        # For items without sizes
-        variant = variants[0]
-        qty_key = f"qty_{name}"
-        if qty_key not in st.session_state.quantities:
-            st.session_state.quantities[qty_key] = 1
-        
-        # Single column for quantity only
-        col1, col2 = st.columns(2)
+        selected_variant = view["default_variant"]
+        stock = view["total_stock"]
+
+    qty = 1
+    if selected_variant:
         with col2:
-            quantities = list(range(1, variant["quantity"] + 1))
-            selected_qty = st.selectbox("Qty:", quantities, index=quantities.index(st.session_state.quantities[qty_key]) if st.session_state.quantities[qty_key] in quantities else 0, key=f"qty_select_{name}")
-            st.session_state.quantities[qty_key] = selected_qty
-    return has_sizes  # Return has_sizes to use in the outer scope
+            # Keyed by size so switching sizes starts again at 1
+            qty_key = f"qty_select_{name}_{selected_variant['size']}" if view["has_sizes"] else f"qty_select_{name}"
+            qty = st.selectbox("Qty:", range(1, selected_variant["quantity"] + 1), key=qty_key)
+
+    # Render price and stock after size and quantity
+    st.markdown(f"<div class='product-info'>Price: {view['price']} EGP<br>Stock: {stock}</div>", unsafe_allow_html=True)
+    notice = st.session_state.card_notices.pop(name, None)
+    if notice:
+        st.success(notice, icon="✅")
+    cart_locked = st.session_state.pending_checkout is not None
+    if selected_variant and st.button("Add to Cart", key=f"add_{selected_variant['id']}", help="Add item to cart",
+                                      disabled=cart_locked):
+        in_cart_qty = st.session_state.cart.get(selected_variant["id"], {}).get("quantity", 0)
+        try:
+            # Holds the cart's new total for this product so other tills can't sell it meanwhile
+            reserve_stock(st.session_state.session_id, selected_variant["id"], in_cart_qty + qty)
+            available_stock = None
+        except InsufficientStockError as e:
+            available_stock = max(e.shortages[0]["available"] - in_cart_qty, 0)
+        if available_stock is None:
+            if selected_variant["id"] in st.session_state.cart:
+                st.session_state.cart[selected_variant["id"]]["quantity"] += qty
+            else:
+                st.session_state.cart[selected_variant["id"]] = {
+                    "id": selected_variant["id"],
+                    "name": selected_variant["name"],
+                    "size": selected_variant["size"] if view["has_sizes"] else "",
+                    "price": selected_variant["price"],
+                    "quantity": qty
+                }
+            if view["has_sizes"]:
+                st.session_state.card_notices[name] = f"{qty} {name.lower()} size {selected_variant['size']} added to cart"
+            else:
+                st.session_state.card_notices[name] = f"{qty} {name.lower()} added to cart"
+            # The cart panel lives outside this fragment; the page only holds one grid page of cards
+            st.rerun()
+        else:
+            st.warning(f"Only {available_stock} left in stock", icon="⚠️")
+    st.markdown("</div>", unsafe_allow_html=True)
+
+# ------------------ Search and Filters ------------------ #
+facets = catalog_facets(catalog)
+search_col, stock_col = st.columns([4, 1])
+with search_col:
+    search_text = st.text_input("Search products", key="product_search", placeholder="Name or part of a name")
+with stock_col:
+    in_stock_only = st.checkbox("In stock only", key="product_in_stock")
+category = st.pills("Category", facets["categories"], key="product_category") if facets["categories"] else None
+size = st.pills("Size", facets["sizes"], key="product_size") if len(facets["sizes"]) > 1 else None
+product_filters = (search_text, category, size, in_stock_only)
+if st.session_state.get("product_filters") != product_filters:
+    # New results start on the first page
+    st.session_state.product_filters = product_filters
+    st.session_state.pop("product_page", None)
+views = search_catalog(catalog, search_text, category=category, size=size, in_stock=in_stock_only)
+if not views and catalog["views"]:
+    st.info("No products match the search.")
 
 # ------------------ Product Display ------------------ #
 num_columns = 3  # Number of cards per row
-for i in range(0, len(grouped), num_columns):
+page_count = max(1, -(-len(views) // PRODUCTS_PER_PAGE))
+page = 1
+if page_count > 1:
+    page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, step=1, key="product_page")
+page_views = views[(page - 1) * PRODUCTS_PER_PAGE:page * PRODUCTS_PER_PAGE]
+for i in range(0, len(page_views), num_columns):
     cols = st.columns(num_columns)
-    for j in range(num_columns):
-        idx = i + j
-        if idx < len(grouped):
-            name, variants = list(grouped.items())[idx]
-            available_variants = [v for v in variants if v["quantity"] > 0]
-            
-            with cols[j]:
-                st.markdown(f"<div class='product-card'><h3 class='product-title'>{name}</h3>", unsafe_allow_html=True)
-                # Render size and quantity first
-                has_sizes = render_size_quantities(name, variants)
-                selected_size = st.session_state.get(f"selected_size_{name}")
-                stock = next((v["quantity"] for v in variants if v["size"] == selected_size), sum(v["quantity"] for v in variants)) if has_sizes and selected_size else sum(v["quantity"] for v in variants)
-                # Render price and stock after size and quantity
-                st.markdown(f"<div class='product-info'>Price: {variants[0]['price']} EGP<br>Stock: {stock}</div>", unsafe_allow_html=True)
-                if available_variants:
-                    if len(variants) > 1:  # Has sizes
-                        selected_size = st.session_state.get(f"selected_size_{name}")
-                        selected_variant = next((v for v in available_variants if v["size"] == selected_size), None)
-                    else:  # No sizes
-                        selected_variant = available_variants[0]
-                        qty_key = f"qty_{name}"
-                    
-                    if selected_variant:
-                        if st.button("Add to Cart", key=f"add_{selected_variant['id']}", help="Add item to cart"):
-                            qty = st.session_state.quantities.get(
-                                f"qty_{name}_{selected_variant['size']}" if len(variants) > 1 else f"qty_{name}", 
-                                1
-                            )
-                            in_cart_qty = st.session_state.cart.get(selected_variant["id"], {}).get("quantity", 0)
-                            available_stock = selected_variant["quantity"] - in_cart_qty
-                            
-                            if qty <= available_stock:
-                                item = {
-                                    "id": selected_variant["id"],
-                                    "name": selected_variant["name"],
-                                    "size": selected_variant["size"] if len(variants) > 1 else "",
-                                    "price": selected_variant["price"],
-                                    "quantity": qty
-                                }
-                                if selected_variant["id"] in st.session_state.cart:
-                                    st.session_state.cart[selected_variant["id"]]["quantity"] += qty
-                                else:
-                                    st.session_state.cart[selected_variant["id"]] = item
-                                if len(variants) > 1:
-                                    st.success(f"{qty} {name.lower()} size {selected_variant['size']} added to cart", icon="✅")
-                                else:
-                                    st.success(f"{qty} {name.lower()} added to cart", icon="✅")
-                            else:
-                                st.warning(f"Only {available_stock} left in stock", icon="⚠️")
-                st.markdown("</div>", unsafe_allow_html=True)
+    for col, view in zip(cols, page_views[i:i + num_columns]):
+        with col:
+            product_card(view)
 
 # ------------------ Cart Display ------------------ #
 st.markdown("---")
 st.markdown("## 🛒 Cart")
 
+pending = st.session_state.pending_checkout
+if pending is not None and pending["future"].done():
+    # The queued order finally committed or failed; only now may the cart change again
+    st.session_state.pending_checkout = None
+    st.session_state.checkout_in_progress = False
+    try:
+        order_id = pending["future"].result()
+        st.session_state.cart = {}
+        st.session_state.warnings["checkout"] = ""
+        st.success(f"✅ Queued order for {pending['camper']} went through: order `{order_id}`, {pending['total']} EGP.")
+    except Exception as e:
+        st.session_state.warnings["checkout"] = f"❌ Checkout failed: {e}"
+    pending = None
+if pending is not None:
+    st.info("⏳ The last checkout is still queued and may yet go through. "
+            "The cart is locked until it completes or fails; don't check it out again.")
+    if st.button("Check again", key="check_pending_checkout"):
+        st.rerun()
+cart_locked = pending is not None
+
 if st.session_state.cart:
     cart_items = list(st.session_state.cart.values())
-    cart_df = pd.DataFrame(cart_items)
-    cart_df["total"] = cart_df["price"] * cart_df["quantity"]
+    # Plain dicts: the cart is a handful of lines, and importing pandas costs ~0.4 s on a cold start
+    cart_rows = [dict(item, total=item["price"] * item["quantity"]) for item in cart_items]
 
     st.markdown("### 🧾 Cart Items")
 
@@ -245,7 +263,7 @@ if st.session_state.cart:
     with col5: st.markdown("**Total**")
     with col6: st.markdown("**🗑️**")
 
-    for index, row in cart_df.iterrows():
+    for row in cart_rows:
         col1, col2, col3, col4, col5, col6 = st.columns([3, 2, 2, 2, 2, 1])
         with col1: st.markdown(row["name"])
         with col2: st.markdown(row["size"])
@@ -253,13 +271,15 @@ if st.session_state.cart:
         with col4: st.markdown(str(row["quantity"]))
         with col5: st.markdown(f"{row['total']} EGP")
         with col6:
-            if st.button("🗑️", key=f"delete_{row['id']}"):
+            if st.button("🗑️", key=f"delete_{row['id']}", disabled=cart_locked):
                 del st.session_state.cart[row["id"]]
-                st.success(f"Removed {row['quantity']} x {row['name']}{f' (Size: {row['size']})' if row['size'] else ''} from cart")
+                release_holds(st.session_state.session_id, [row["id"]])
+                size_note = f" (Size: {row['size']})" if row["size"] else ""
+                st.success(f"Removed {row['quantity']} x {row['name']}{size_note} from cart")
                 st.rerun()
 
     # Show total
-    total = cart_df["total"].sum()
+    total = sum(row["total"] for row in cart_rows)
     st.markdown(f"<h3 style='color: #00cc00;'>Total: {total} EGP</h3>", unsafe_allow_html=True)
 
     # Camper Name Input
@@ -268,12 +288,13 @@ if st.session_state.cart:
     # Buttons: Clear + Checkout
     col_c1, col_c2, col_c3 = st.columns([1, 1, 1])
     with col_c1:
-        if st.button("🗑️ Clear Cart"):
+        if st.button("🗑️ Clear Cart", disabled=cart_locked):
             st.session_state.cart = {}
+            release_holds(st.session_state.session_id)
             st.success("🧹 Cart cleared.")
             st.rerun()
     with col_c2:
-        if st.button("💳 Checkout"):
+        if st.button("💳 Checkout", disabled=cart_locked):
             if not camper_name.strip():
                 st.warning("Please enter a camper name.")
             elif st.session_state.checkout_in_progress:
@@ -281,44 +302,42 @@ if st.session_state.cart:
             else:
                 st.session_state.checkout_in_progress = True
                 try:
-                    with get_connection() as conn:
-                        conn.execute("PRAGMA journal_mode=WAL;")
-                        conn.execute("PRAGMA busy_timeout=60000;")
-                        cursor = conn.execute("SELECT id FROM products")
-                        current_ids = {row[0] for row in cursor.fetchall()}
-                        missing = [item["id"] for item in cart_items if item["id"] not in current_ids]
-                        if missing:
-                            st.session_state.warnings["checkout"] = f"❌ Product ID(s) missing: {missing}"
-                        else:
-                            success = False
-                            attempt = 0
-                            max_attempts = 5
-                            while attempt < max_attempts and not success:
-                                attempt += 1
-                                try:
-                                    conn.execute("BEGIN IMMEDIATE;")
-                                    order_id = save_order(cart_items, total, conn, camper_name=camper_name)
-                                    conn.commit()
-                                    success = True
-                                except Exception as e:
-                                    conn.rollback()
-                                    if "locked" in str(e).lower() and attempt < max_attempts:
-                                        time.sleep(1.0 * attempt)
-                                    else:
-                                        st.session_state.warnings["checkout"] = f"❌ Checkout failed: {e}"
-                                        break
-                            if success:
-                                st.success("✅ Order complete. Receipt saved.")
-                                st.markdown(f"- 🧾 **Order ID:** `{order_id}`")
-                                st.markdown(f"- 💰 **Total:** `{total} EGP`")
-                                st.markdown(f"- ⏰ **Time:** `{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}`")
-                                st.markdown(f"- 👤 **Camper:** `{camper_name}`")
-                                st.session_state.cart = {}
-                                st.session_state.checkout_in_progress = False
-                                st.session_state.warnings["checkout"] = ""
-                                st.rerun()
-                            else:
-                                st.session_state.checkout_in_progress = False
+                    # Existence, stock and price of just the cart's products, in one query
+                    validation = validate_cart(cart_items, session_id=st.session_state.session_id)
+                    for error in validation["errors"]:
+                        if error["code"] == "price_changed":
+                            st.session_state.cart[error["id"]]["price"] = error["price"]
+                    success = False
+                    if validation["errors"]:
+                        messages = "<br>".join(error["message"] for error in validation["errors"])
+                        st.session_state.warnings["checkout"] = f"❌ Please review the cart before checkout:<br>{messages}"
+                    else:
+                        # Queued behind other tills; the writer thread commits it and converts the holds
+                        future = submit_order(
+                            cart_items, int(total), camper_name=camper_name, session_id=st.session_state.session_id
+                        )
+                        try:
+                            order_id = future.result(timeout=CHECKOUT_TIMEOUT)
+                            success = True
+                        except FutureTimeoutError:
+                            # Still queued and may yet commit, so a retry could sell the cart twice
+                            st.session_state.pending_checkout = {"future": future, "camper": camper_name, "total": total}
+                        except Exception as e:
+                            st.session_state.warnings["checkout"] = f"❌ Checkout failed: {e}"
+                    if success:
+                        st.success("✅ Order complete. Receipt saved.")
+                        st.markdown(f"- 🧾 **Order ID:** `{order_id}`")
+                        st.markdown(f"- 💰 **Total:** `{total} EGP`")
+                        st.markdown(f"- ⏰ **Time:** `{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}`")
+                        st.markdown(f"- 👤 **Camper:** `{camper_name}`")
+                        st.session_state.cart = {}
+                        st.session_state.checkout_in_progress = False
+                        st.session_state.warnings["checkout"] = ""
+                        st.rerun()
+                    elif st.session_state.pending_checkout is not None:
+                        st.rerun()  # locks the cart behind the pending notice
+                    else:
+                        st.session_state.checkout_in_progress = False
                 except Exception as outer_e:
                     st.session_state.warnings["checkout"] = f"Unexpected error during checkout: {outer_e}"
                     st.session_state.checkout_in_progress = False
@@ -330,3 +349,5 @@ if st.session_state.warnings.get("checkout"):
     st.markdown(f"<div class='warning-box'>{st.session_state.warnings['checkout']}</div>", unsafe_allow_html=True)
     if st.button("✖ Clear Checkout Warning", key="clear_checkout_warning"):
         st.session_state.warnings["checkout"] = ""
+
+instrumentation.page_rendered("POS", RENDER_STARTED)
@@ -0,0 +1,200 @@
+"""Benchmarks for the store database layer.
+
+Builds a synthetic catalog and order history in a temporary store.db and
+times imports, catalog reads, checkout throughput and report building.
+
+    python -m benchmarks.run --skus 1000 --orders 10000 --threads 8 --out bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import database
+import exports
+import report_service
+from benchmarks.synthetic import catalog_frame, order_history, random_carts
+
+HISTORY_BATCH = 10000
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+    return {
+        "p50_ms": round(pick(0.50) * 1000, 3),
+        "p95_ms": round(pick(0.95) * 1000, 3),
+        "p99_ms": round(pick(0.99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+    }
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+def bench_import(df):
+    seconds, counts = timed(database.bulk_upload_products, df, overwrite=True)
+    return {"rows": len(df), "seconds": round(seconds, 4), "rows_per_s": round(len(df) / seconds), **counts}
+
+def bench_reimport(df):
+    # Same rows again: measures the unchanged-row fast path
+    seconds, counts = timed(database.bulk_upload_products, df)
+    return {"rows": len(df), "seconds": round(seconds, 4), "rows_per_s": round(len(df) / seconds), **counts}
+
+def bench_catalog_reads(repeats=20):
+    cold = []
+    for _ in range(repeats):
+        with database.connection() as conn:
+            database.bump_catalog_version(conn.cursor())
+            conn.commit()
+        cold.append(timed(database.get_catalog)[0])
+    warm = [timed(database.get_catalog)[0] for _ in range(repeats)]
+    get_products = [timed(database.get_products)[0] for _ in range(repeats)]
+    return {"get_products": percentiles(get_products), "get_catalog_cold": percentiles(cold), "get_catalog_warm": percentiles(warm)}
+
+def load_history(products, orders):
+    # Written straight into the tables in large transactions; the aggregates are rebuilt once
+    started = time.perf_counter()
+    with database.connection() as conn:
+        c = conn.cursor()
+        history = order_history(products, orders)
+        written = 0
+        while written < orders:
+            conn.execute("BEGIN IMMEDIATE;")
+            for timestamp, total, camper_name, items in history:
+                c.execute(
+                    "INSERT INTO orders (timestamp, created_at, total, camper_name) VALUES (?, ?, ?, ?)",
+                    (timestamp, database.local_to_epoch(timestamp), total, camper_name)
+                )
+                order_id = c.lastrowid
+                c.executemany(
+                    "INSERT INTO order_items (order_id, product_id, name, size, price, quantity) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(order_id, *item) for item in items]
+                )
+                written += 1
+                if written % HISTORY_BATCH == 0:
+                    break
+            conn.commit()
+        conn.execute("BEGIN IMMEDIATE;")
+        database._rebuild_sales_aggregates(c)
+        database.bump_orders_version(c)
+        conn.commit()
+    seconds = time.perf_counter() - started
+    return {"orders": orders, "seconds": round(seconds, 3), "orders_per_s": round(orders / seconds)}
+
+def bench_save_order(products, count):
+    latencies = []
+    for cart in random_carts(products, count, seed=1):
+        with database.connection() as conn:
+            latencies.append(timed(database.save_order, cart, sum(p["price"] for p in cart), conn, camper_name="Bench")[0])
+    return {"orders": count, "orders_per_s": round(count / sum(latencies)), **percentiles(latencies)}
+
+def bench_checkout(products, threads, orders_per_thread):
+    # Each thread is a till submitting orders one after another through the checkout queue
+    latencies, failures = [], []
+    lock = threading.Lock()
+
+    def till(seed):
+        for cart in random_carts(products, orders_per_thread, seed=seed):
+            started = time.perf_counter()
+            try:
+                database.submit_order(cart, sum(p["price"] for p in cart), camper_name=f"Till {seed}").result(timeout=120)
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+            except Exception as e:
+                with lock:
+                    failures.append(type(e).__name__)
+
+    workers = [threading.Thread(target=till, args=(seed,)) for seed in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    seconds = time.perf_counter() - started
+    return {
+        "threads": threads, "orders": len(latencies), "failures": len(failures),
+        "seconds": round(seconds, 3), "orders_per_s": round(len(latencies) / seconds), **percentiles(latencies),
+    }
+
+def bench_reports(export_dir):
+    results = {}
+    for name, fn in [
+        ("daily_sales", database.get_daily_sales),
+        ("camper_totals", database.get_camper_totals),
+        ("product_sales", database.get_product_sales),
+        ("orders_first_page", lambda: database.get_orders_page()),
+        ("orders_deep_page", lambda: database.get_orders_page(before_id=100)),
+        ("camper_search", lambda: database.search_orders_by_camper("ann")),
+        ("sales_by_day_60d", lambda: database.get_sales_by_period(date.today() - timedelta(days=60), date.today())),
+    ]:
+        results[name] = percentiles([timed(fn)[0] for _ in range(10)])
+
+    # The Receipts summaries, as the background report builder computes them
+    results["report_snapshot_s"] = round(timed(report_service.build_snapshot)[0], 3)
+
+    exports.EXPORT_DIR = export_dir
+    for fmt in ("zip", "xlsx") if exports.available_excel_engine() else ("zip",):
+        results[f"full_export_{fmt}_s"] = round(timed(exports.full_export, fmt)[0], 3)
+    return results
+
+def run(skus, orders, threads, orders_per_thread, save_orders, keep=None):
+    workdir = tempfile.mkdtemp(prefix="store-bench-")
+    database.DB_NAME = os.path.join(workdir, "store.db")
+    try:
+        database.init_db()
+        catalog = catalog_frame(skus)
+        results = {"import": bench_import(catalog), "reimport": bench_reimport(catalog)}
+        products = database.get_products()
+        results["catalog_reads"] = bench_catalog_reads()
+        results["history_load"] = load_history(products, orders)
+        results["save_order"] = bench_save_order(products, save_orders)
+        results["checkout"] = bench_checkout(products, threads, orders_per_thread)
+        results["reports"] = bench_reports(os.path.join(workdir, "exports"))
+        results["db_size_mb"] = round(os.path.getsize(database.DB_NAME) / 1e6, 2)
+        if keep:
+            database.close_pool()
+            shutil.copy(database.DB_NAME, keep)
+        return results
+    finally:
+        database.close_pool()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the store database layer on synthetic data.")
+    parser.add_argument("--skus", type=int, default=1000, help="catalog rows (1k-100k)")
+    parser.add_argument("--orders", type=int, default=10000, help="order history size (10k-1M)")
+    parser.add_argument("--threads", type=int, default=8, help="concurrent tills for the checkout run")
+    parser.add_argument("--orders-per-thread", type=int, default=50)
+    parser.add_argument("--save-orders", type=int, default=200, help="sequential save_order calls")
+    parser.add_argument("--out", help="write the JSON results here as well as to stdout")
+    parser.add_argument("--keep-db", help="copy the benchmark database here when done")
+    args = parser.parse_args(argv)
+
+    report = {
+        "meta": {
+            "started": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "params": vars(args),
+        },
+        "results": run(args.skus, args.orders, args.threads, args.orders_per_thread, args.save_orders, args.keep_db),
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import random
+from datetime import datetime, timedelta
+import pandas as pd
+
+NAMES = ["T-Shirt", "Hoodie", "Cap", "Shorts", "Jacket", "Socks", "Water Bottle", "Mug", "Sticker", "Flag"]
+COLORS = ["Red", "Blue", "Green", "Black", "White", "Navy", "Camo", "Sunset"]
+CATEGORIES = ["tops", "bottoms", "accessories", "drinkware", "souvenirs"]
+SIZES = ["XS", "S", "M", "L", "XL"]
+CAMPERS = ["Ann", "Bob", "Cy", "Dana", "Eli", "Fay", "Gus", "Hana", "Ivo", "Jo"]
+
+def catalog_frame(skus, seed=0):
+    # skus rows, grouped into named products of one to five sizes
+    rng = random.Random(seed)
+    rows = []
+    product = 0
+    while len(rows) < skus:
+        product += 1
+        name = f"{rng.choice(COLORS)} {rng.choice(NAMES)} {product}"
+        category = rng.choice(CATEGORIES)
+        price = rng.randrange(50, 1500, 10)
+        sizes = SIZES[:rng.randint(1, len(SIZES))] if category in ("tops", "bottoms") else [""]
+        for size in sizes[:skus - len(rows)]:
+            rows.append({
+                "id": len(rows) + 1, "name": name, "category": category,
+                "size": size, "price": price, "quantity": rng.randint(0, 500),
+            })
+    return pd.DataFrame(rows)
+
+def order_history(products, orders, days=60, seed=0):
+    # Yields (timestamp, total, camper_name, items) with items as (product_id, name, size, price, quantity)
+    rng = random.Random(seed)
+    start = datetime.now() - timedelta(days=days)
+    step = timedelta(days=days) / max(orders, 1)
+    campers = [f"{rng.choice(CAMPERS)} {n}" for n in range(max(orders // 20, 1))]
+    for n in range(orders):
+        picked = rng.sample(products, min(rng.randint(1, 4), len(products)))
+        items = [(p["id"], p["name"], p["size"], p["price"], rng.randint(1, 3)) for p in picked]
+        total = sum(price * qty for _, _, _, price, qty in items)
+        timestamp = (start + step * n).strftime("%Y-%m-%d %H:%M:%S")
+        yield timestamp, total, rng.choice(campers), items
+
+def random_carts(products, count, seed=0):
+    rng = random.Random(seed)
+    in_stock = [p for p in products if p["quantity"] > 0]
+    for _ in range(count):
+        picked = rng.sample(in_stock, min(rng.randint(1, 3), len(in_stock)))
+        yield [dict(p, quantity=1) for p in picked]
@@ -0,0 +1,122 @@
+import re
+import threading
+
+# In-memory product search over the cached catalog. Postings are kept per
+# product name and only the names whose variants changed are re-indexed when
+# the catalog version moves.
+_TOKEN_RE = re.compile(r"\w+")
+
+def tokenize(text):
+    return _TOKEN_RE.findall(str(text).lower())
+
+def _signature(view):
+    return tuple((v["id"], v["category"], v["size"], v["quantity"]) for v in view["variants"])
+
+class CatalogIndex:
+    def __init__(self):
+        self.db_name = None
+        self.version = None
+        self.views = {}       # name -> view model
+        self.positions = {}   # name -> position in catalog order
+        self.signatures = {}
+        self.tokens = {}      # name -> set of whole-word tokens
+        self.prefixes = {}    # token prefix -> names
+        self.categories = {}  # category -> names
+        self.sizes = {}       # size -> names with that size in stock
+
+    def _add(self, name, view):
+        words = set(tokenize(name))
+        self.tokens[name] = words
+        for word in words:
+            for end in range(1, len(word) + 1):
+                self.prefixes.setdefault(word[:end], set()).add(name)
+        for category in view["categories"]:
+            self.categories.setdefault(category, set()).add(name)
+        for size in view["available_sizes"]:
+            if size:  # unsized variants have no size to filter by
+                self.sizes.setdefault(size, set()).add(name)
+
+    def _remove(self, name):
+        for word in self.tokens.pop(name, ()):
+            for end in range(1, len(word) + 1):
+                _discard(self.prefixes, word[:end], name)
+        view = self.views[name]
+        for category in view["categories"]:
+            _discard(self.categories, category, name)
+        for size in view["available_sizes"]:
+            if size:
+                _discard(self.sizes, size, name)
+
+    def update(self, catalog):
+        # Re-index only the names whose variants changed since the last version
+        if self.db_name != catalog["db_name"]:
+            self.__init__()
+            self.db_name = catalog["db_name"]
+        current = {view["name"]: view for view in catalog["views"]}
+        for name in list(self.views):
+            if name not in current:
+                self._remove(name)
+                del self.views[name], self.signatures[name]
+        for name, view in current.items():
+            signature = _signature(view)
+            if self.signatures.get(name) == signature:
+                self.views[name] = view
+                continue
+            if name in self.views:
+                self._remove(name)
+            self.views[name] = view
+            self.signatures[name] = signature
+            self._add(name, view)
+        self.positions = {name: i for i, name in enumerate(current)}
+        self.version = catalog["version"]
+
+    def facets(self):
+        return {"categories": sorted(self.categories), "sizes": sorted(self.sizes)}
+
+    def search(self, text="", category=None, size=None, in_stock=False):
+        words = tokenize(text)
+        names = None
+        for word in words:
+            matches = self.prefixes.get(word, set())
+            names = matches if names is None else names & matches
+        if names is None:
+            names = set(self.views)
+        if category:
+            names = names & self.categories.get(category, set())
+        if size:
+            names = names & self.sizes.get(size, set())
+        if in_stock:
+            names = {name for name in names if self.views[name]["total_stock"] > 0}
+
+        # Whole-word hits rank above prefix hits, names starting with the query first
+        query = " ".join(words)
+        def rank(name):
+            exact = sum(1 for word in words if word in self.tokens[name])
+            leading = " ".join(tokenize(name)).startswith(query) if query else False
+            return (-exact, not leading, self.positions[name])
+        return [self.views[name] for name in sorted(names, key=rank)]
+
+def _discard(postings, key, name):
+    names = postings.get(key)
+    if names is not None:
+        names.discard(name)
+        if not names:
+            del postings[key]
+
+_index = CatalogIndex()
+_index_lock = threading.Lock()
+
+def _sync(catalog):
+    # Brings the shared index up to the given catalog's version; call under _index_lock
+    if _index.db_name != catalog["db_name"] or _index.version != catalog["version"]:
+        _index.update(catalog)
+
+def search_catalog(catalog, text="", category=None, size=None, in_stock=False):
+    with _index_lock:
+        _sync(catalog)
+        return _index.search(text, category=category, size=size, in_stock=in_stock)
+
+def catalog_facets(catalog):
+    with _index_lock:
+        _sync(catalog)
+        return _index.facets()
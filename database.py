@@ -1,6 +1,15 @@
+import os
+import queue
+import re
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
 import logging
+import instrumentation
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, filename='store.log', format='%(asctime)s %(levelname)s: %(message)s')
@@ -8,169 +17,1491 @@ logging.basicConfig(level=logging.INFO, filename='store.log', format='%(asctime)
 DB_NAME = "store.db"
 
 def get_connection():
-    conn = sqlite3.connect(DB_NAME, check_same_thread=False, timeout=60)  # 60-second timeout
-    conn.execute("PRAGMA journal_mode=WAL;")  # Enable WAL mode
-    conn.execute("PRAGMA busy_timeout=60000;")  # 60 seconds
+    with instrumentation.timer("connect"):
+        conn = sqlite3.connect(
+            DB_NAME, check_same_thread=False, timeout=60,  # 60-second timeout
+            factory=instrumentation.connection_factory()
+        )
+        conn.execute("PRAGMA journal_mode=WAL;")  # Enable WAL mode
+        conn.execute("PRAGMA busy_timeout=60000;")  # 60 seconds
     return conn
 
-def init_db():
-    conn = get_connection()
+# ------------------ Connection Pool ------------------ #
+# Streamlit runs every session on its own script thread, so connections are
+# handed out to one thread at a time and returned to a shared idle list.
+POOL_MAX_SIZE = 8
+POOL_IDLE_TIMEOUT = 300  # seconds an idle connection is kept open
+POOL_ACQUIRE_TIMEOUT = 60  # seconds to wait when every connection is busy
+
+_pool_cond = threading.Condition()
+_pool_idle = []  # (conn, db_name, released_at), most recently used last
+_pool_size = 0
+_pool_stats = {"hits": 0, "misses": 0, "waits": 0, "evicted": 0, "unhealthy": 0}
+_pool_local = threading.local()
+
+def _close_quietly(conn):
     try:
-        c = conn.cursor()
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY,
-            name TEXT NOT NULL,
-            category TEXT,
-            size TEXT,
-            price INTEGER NOT NULL,
-            quantity INTEGER NOT NULL
-        )
-        """)
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            total INTEGER NOT NULL,
-            camper_name TEXT  -- Added camper_name column
-        )
-        """)
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS order_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            order_id INTEGER,
-            product_id INTEGER,
-            name TEXT,
-            size TEXT,
-            price INTEGER,
-            quantity INTEGER,
-            FOREIGN KEY(order_id) REFERENCES orders(id),
-            FOREIGN KEY(product_id) REFERENCES products(id)
-        )
-        """)
-        conn.commit()
-    except Exception as e:
-        logging.error(f"Database initialization failed: {str(e)}")
-        raise
-    finally:
         conn.close()
+    except sqlite3.Error:
+        pass
 
-def get_products():
-    conn = get_connection()
+def _is_healthy(conn):
     try:
-        cursor = conn.execute("SELECT * FROM products")
-        rows = cursor.fetchall()
-        columns = ["id", "name", "category", "size", "price", "quantity"]
-        return [dict(zip(columns, row)) for row in rows]
-    except Exception as e:
-        logging.error(f"Error fetching products: {str(e)}")
-        raise
+        conn.execute("SELECT 1").fetchone()
+        return True
+    except sqlite3.Error:
+        return False
+
+def _evict_idle(now):
+    # Caller holds _pool_cond
+    global _pool_size
+    keep = []
+    for conn, db_name, released_at in _pool_idle:
+        if db_name != DB_NAME or now - released_at > POOL_IDLE_TIMEOUT:
+            _close_quietly(conn)
+            _pool_size -= 1
+            _pool_stats["evicted"] += 1
+        else:
+            keep.append((conn, db_name, released_at))
+    _pool_idle[:] = keep
+
+def _acquire():
+    global _pool_size
+    deadline = time.monotonic() + POOL_ACQUIRE_TIMEOUT
+    while True:
+        conn = None
+        with _pool_cond:
+            _evict_idle(time.monotonic())
+            if _pool_idle:
+                conn = _pool_idle.pop()[0]
+            elif _pool_size < POOL_MAX_SIZE:
+                _pool_size += 1
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise sqlite3.OperationalError("Connection pool exhausted")
+                _pool_stats["waits"] += 1
+                _pool_cond.wait(remaining)
+                continue
+
+        if conn is None:
+            try:
+                conn = get_connection()
+            except Exception:
+                with _pool_cond:
+                    _pool_size -= 1
+                    _pool_cond.notify()
+                raise
+            with _pool_cond:
+                _pool_stats["misses"] += 1
+            return conn
+
+        if _is_healthy(conn):
+            with _pool_cond:
+                _pool_stats["hits"] += 1
+            return conn
+
+        _close_quietly(conn)
+        with _pool_cond:
+            _pool_size -= 1
+            _pool_stats["unhealthy"] += 1
+
+def _release(conn, db_name):
+    global _pool_size
+    reusable = True
+    if conn.in_transaction:
+        # Never hand a half-finished transaction to the next caller
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            reusable = False
+    with _pool_cond:
+        if reusable and db_name == DB_NAME:
+            _pool_idle.append((conn, db_name, time.monotonic()))
+        else:
+            _close_quietly(conn)
+            _pool_size -= 1
+        _pool_cond.notify()
+
+@contextmanager
+def connection():
+    # Nested use on the same thread shares the outer connection (and its transaction)
+    held = getattr(_pool_local, "conn", None)
+    if held is not None:
+        yield held
+        return
+    db_name = DB_NAME
+    with instrumentation.timer("pool acquire"):
+        conn = _acquire()
+    _pool_local.conn = conn
+    try:
+        yield conn
     finally:
-        conn.close()
+        _pool_local.conn = None
+        _release(conn, db_name)
+
+def pool_stats():
+    with _pool_cond:
+        stats = dict(_pool_stats)
+        stats["size"] = _pool_size
+        stats["idle"] = len(_pool_idle)
+    return stats
+
+def close_pool():
+    global _pool_size
+    with _pool_cond:
+        for conn, _, _ in _pool_idle:
+            _close_quietly(conn)
+        _pool_size -= len(_pool_idle)
+        _pool_idle.clear()
+
+# ------------------ Store Time ------------------ #
+# orders.created_at is UTC epoch seconds; orders.timestamp keeps the store's
+# local wall-clock time as text for display and the per-day summaries.
+STORE_TIMEZONE = "Africa/Cairo"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+_store_tz = ZoneInfo(STORE_TIMEZONE)
+
+def local_to_epoch(text):
+    # A stored local timestamp (or date) read as store time; None if unparseable
+    try:
+        parsed = datetime.strptime(str(text)[:19], TIMESTAMP_FORMAT)
+    except ValueError:
+        try:
+            parsed = datetime.strptime(str(text)[:10], "%Y-%m-%d")
+        except ValueError:
+            return None
+    return int(parsed.replace(tzinfo=_store_tz).timestamp())
+
+def epoch_to_local(epoch):
+    return datetime.fromtimestamp(epoch, _store_tz)
+
+def _as_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
 
-def update_product_quantity(product_id, qty_sold, conn):
+def local_day_start(day):
+    # Epoch of local midnight; DST days are 23 or 25 hours long
+    day = _as_date(day)
+    return int(datetime(day.year, day.month, day.day, tzinfo=_store_tz).timestamp())
+
+def _created_at_conditions(start_date, end_date, column="o.created_at"):
+    # Inclusive local dates as an epoch range on the indexed column
+    conditions, params = [], []
+    if start_date is not None:
+        conditions.append(f"{column} >= ?")
+        params.append(local_day_start(start_date))
+    if end_date is not None:
+        conditions.append(f"{column} < ?")
+        params.append(local_day_start(_as_date(end_date) + timedelta(days=1)))
+    return conditions, params
+
+def period_bounds(start_date, end_date, period="day"):
+    # [(label, start_epoch, end_epoch)] covering start_date..end_date in local time.
+    # "day" and "week" (weeks start on Monday, labelled by that date) split the range;
+    # "session" is the whole range as one bucket.
+    start, end = _as_date(start_date), _as_date(end_date)
+    if period == "session":
+        return [(f"{start}..{end}", local_day_start(start), local_day_start(end + timedelta(days=1)))]
+    if period == "week":
+        first, step = start - timedelta(days=start.weekday()), timedelta(days=7)
+    elif period == "day":
+        first, step = start, timedelta(days=1)
+    else:
+        raise ValueError(f"Unknown period {period!r}; use day, week or session.")
+    bounds = []
+    bucket = first
+    while bucket <= end:
+        bounds.append((bucket.isoformat(), local_day_start(max(bucket, start)),
+                       local_day_start(min(bucket + step, end + timedelta(days=1)))))
+        bucket += step
+    return bounds
+
+# ------------------ Schema Migrations ------------------ #
+# MIGRATIONS[i] upgrades a database from PRAGMA user_version i to i + 1.
+# Append new steps; never edit one that has shipped.
+def _migrate_base_schema(c):
+    # Databases created before versioning already have these tables
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        category TEXT,
+        size TEXT,
+        price INTEGER NOT NULL,
+        quantity INTEGER NOT NULL
+    )
+    """)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT NOT NULL,
+        total INTEGER NOT NULL,
+        camper_name TEXT  -- Added camper_name column
+    )
+    """)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS order_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER,
+        product_id INTEGER,
+        name TEXT,
+        size TEXT,
+        price INTEGER,
+        quantity INTEGER,
+        FOREIGN KEY(order_id) REFERENCES orders(id),
+        FOREIGN KEY(product_id) REFERENCES products(id)
+    )
+    """)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS store_meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+    """)
+    c.execute("INSERT OR IGNORE INTO store_meta (key, value) VALUES ('catalog_version', 0)")
+
+def _migrate_indexes(c):
+    # Covers get_order_items / receipt item lookups without touching the table
+    c.execute("""
+    CREATE INDEX IF NOT EXISTS idx_order_items_order
+    ON order_items(order_id, product_id, name, size, price, quantity)
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_order_items_product ON order_items(product_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_timestamp ON orders(timestamp)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_camper ON orders(camper_name COLLATE NOCASE)")
+    duplicates = c.execute("""
+        SELECT name, size FROM products GROUP BY name, size HAVING COUNT(*) > 1 LIMIT 5
+    """).fetchall()
+    if duplicates:
+        # Don't fail startup over existing data; keep the lookup index without the constraint
+        logging.warning(f"Duplicate products by (name, size), unique index not created: {duplicates}")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_products_name_size ON products(name, size)")
+    else:
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_products_name_size ON products(name, size)")
+
+def _migrate_sales_aggregates(c):
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS daily_sales (
+        day TEXT PRIMARY KEY,  -- YYYY-MM-DD, local date the order was taken
+        order_count INTEGER NOT NULL,
+        total REAL NOT NULL
+    )
+    """)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS camper_totals (
+        camper_name TEXT PRIMARY KEY,
+        order_count INTEGER NOT NULL,
+        total REAL NOT NULL
+    )
+    """)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS product_sales (
+        product_id INTEGER PRIMARY KEY,
+        name TEXT,
+        size TEXT,
+        quantity INTEGER NOT NULL,
+        revenue REAL NOT NULL
+    )
+    """)
+    _rebuild_sales_aggregates(c)
+
+def _migrate_camper_search(c):
+    # FTS5 index over orders.camper_name, kept in sync by triggers on every checkout
     try:
-        cur = conn.cursor()
-        cur.execute("SELECT quantity FROM products WHERE id = ?", (product_id,))
-        result = cur.fetchone()
-        if result is None:
-            raise ValueError(f"Product ID {product_id} not found.")
-        if result[0] < qty_sold:
-            raise ValueError(f"Insufficient stock for product ID {product_id}. Available: {result[0]}, Requested: {qty_sold}")
-        cur.execute(
-            "UPDATE products SET quantity = quantity - ? WHERE id = ?",
-            (int(qty_sold), int(product_id))
+        c.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS orders_fts USING fts5(
+            camper_name,
+            content='orders',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='1 2 3'
         )
+        """)
+    except sqlite3.OperationalError as e:
+        # search_orders_by_camper falls back to the camper_name index
+        logging.warning(f"FTS5 unavailable, camper search will use LIKE: {str(e)}")
+        return
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS orders_fts_insert AFTER INSERT ON orders BEGIN
+        INSERT INTO orders_fts (rowid, camper_name) VALUES (new.id, new.camper_name);
+    END
+    """)
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS orders_fts_delete AFTER DELETE ON orders BEGIN
+        INSERT INTO orders_fts (orders_fts, rowid, camper_name) VALUES ('delete', old.id, old.camper_name);
+    END
+    """)
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS orders_fts_update AFTER UPDATE OF camper_name ON orders BEGIN
+        INSERT INTO orders_fts (orders_fts, rowid, camper_name) VALUES ('delete', old.id, old.camper_name);
+        INSERT INTO orders_fts (rowid, camper_name) VALUES (new.id, new.camper_name);
+    END
+    """)
+    c.execute("INSERT INTO orders_fts (orders_fts) VALUES ('rebuild')")
+
+def _migrate_orders_version(c):
+    c.execute("INSERT OR IGNORE INTO store_meta (key, value) VALUES ('orders_version', 0)")
+
+def _migrate_stock_holds(c):
+    # Per-session reservations; expires_at is epoch seconds and expired rows are ignored
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS stock_holds (
+        session_id TEXT NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL CHECK (quantity > 0),
+        expires_at REAL NOT NULL,
+        PRIMARY KEY (session_id, product_id)
+    )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_stock_holds_product ON stock_holds(product_id, expires_at)")
+
+def _migrate_order_archives(c):
+    # Registry of per-period archive files under data/archives next to the database
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS order_archives (
+        name TEXT PRIMARY KEY,
+        file_name TEXT NOT NULL,
+        first_id INTEGER,
+        last_id INTEGER,
+        first_timestamp TEXT,
+        last_timestamp TEXT,
+        order_count INTEGER NOT NULL DEFAULT 0,
+        archived_at TEXT NOT NULL
+    )
+    """)
+
+def _migrate_order_epochs(c):
+    # Existing text timestamps were written in store-local time
+    c.execute("ALTER TABLE orders ADD COLUMN created_at INTEGER")
+    c.connection.create_function("store_local_to_epoch", 1, local_to_epoch, deterministic=True)
+    c.execute("UPDATE orders SET created_at = store_local_to_epoch(timestamp)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at)")
+    c.execute("DROP INDEX IF EXISTS idx_orders_timestamp")  # date filters use created_at now
+
+def _migrate_product_row_versions(c):
+    # row_version is the catalog version a product's current state first appears in;
+    # triggers keep it (and tombstones for deletes) current on every write path.
+    # It is read before the writer bumps the version, hence the + 1.
+    c.execute("ALTER TABLE products ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0")
+    c.execute("UPDATE products SET row_version = (SELECT value FROM store_meta WHERE key = 'catalog_version')")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_products_row_version ON products(row_version)")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS product_tombstones (
+        product_id INTEGER PRIMARY KEY,
+        row_version INTEGER NOT NULL
+    )
+    """)
+    next_version = "(SELECT value + 1 FROM store_meta WHERE key = 'catalog_version')"
+    c.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS products_row_version_insert AFTER INSERT ON products BEGIN
+        UPDATE products SET row_version = {next_version} WHERE id = new.id;
+        DELETE FROM product_tombstones WHERE product_id = new.id;
+    END
+    """)
+    c.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS products_row_version_update
+    AFTER UPDATE OF id, name, category, size, price, quantity ON products BEGIN
+        UPDATE products SET row_version = {next_version} WHERE id = new.id;
+        INSERT OR REPLACE INTO product_tombstones (product_id, row_version)
+        SELECT old.id, {next_version} WHERE old.id != new.id;
+    END
+    """)
+    c.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS products_row_version_delete AFTER DELETE ON products BEGIN
+        INSERT OR REPLACE INTO product_tombstones (product_id, row_version) VALUES (old.id, {next_version});
+    END
+    """)
+
+MIGRATIONS = [
+    _migrate_base_schema,
+    _migrate_indexes,
+    _migrate_sales_aggregates,
+    _migrate_camper_search,
+    _migrate_orders_version,
+    _migrate_stock_holds,
+    _migrate_order_archives,
+    _migrate_order_epochs,
+    _migrate_product_row_versions,
+]
+
+_schema_lock = threading.Lock()
+_schema_ready = set()  # DB paths already migrated by this process
+
+def migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= len(MIGRATIONS):
+        return version
+    try:
+        conn.execute("BEGIN IMMEDIATE;")
+        # Re-read under the write lock in case another process just migrated
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        c = conn.cursor()
+        for target in range(version + 1, len(MIGRATIONS) + 1):
+            MIGRATIONS[target - 1](c)
+            c.execute(f"PRAGMA user_version = {target}")
+            logging.info(f"Migrated {DB_NAME} to schema version {target}")
         conn.commit()
-    except Exception as e:
-        logging.error(f"Error updating product quantity for ID {product_id}: {str(e)}")
+    except Exception:
         conn.rollback()
         raise
+    return len(MIGRATIONS)
 
-def bulk_upload_products(df, overwrite=False):
-    conn = get_connection()
+def init_db():
+    # Schema work runs once per process per database, not on every page render
+    if DB_NAME in _schema_ready:
+        return
+    with _schema_lock:
+        if DB_NAME in _schema_ready:
+            return
+        with instrumentation.timer("init_db"), connection() as conn:
+            try:
+                migrate(conn)
+            except Exception as e:
+                logging.error(f"Database initialization failed: {str(e)}")
+                raise
+        _schema_ready.add(DB_NAME)
+
+def get_products():
+    with connection() as conn:
+        try:
+            cursor = conn.execute("SELECT id, name, category, size, price, quantity FROM products")
+            rows = cursor.fetchall()
+            columns = ["id", "name", "category", "size", "price", "quantity"]
+            return [dict(zip(columns, row)) for row in rows]
+        except Exception as e:
+            logging.error(f"Error fetching products: {str(e)}")
+            raise
+
+# ------------------ Catalog Cache ------------------ #
+# Every write to products bumps store_meta.catalog_version in the same
+# transaction, so readers only rebuild the catalog when that number moves.
+# (PRAGMA data_version is per connection and can't be shared across the pool.)
+_catalog_lock = threading.Lock()
+_catalog_cache = {"db_name": None, "version": None, "products": [], "grouped": {}, "views": []}
+
+def bump_catalog_version(c):
+    c.execute("UPDATE store_meta SET value = value + 1 WHERE key = 'catalog_version'")
+
+def _read_catalog_version(conn):
+    row = conn.execute("SELECT value FROM store_meta WHERE key = 'catalog_version'").fetchone()
+    return row[0] if row else 0
+
+def get_catalog_version():
+    with connection() as conn:
+        return _read_catalog_version(conn)
+
+def bump_orders_version(c):
+    c.execute("UPDATE store_meta SET value = value + 1 WHERE key = 'orders_version'")
+
+def read_data_version(conn):
+    # Moves whenever products or orders change; keys caches of whole-store reports
+    rows = dict(conn.execute(
+        "SELECT key, value FROM store_meta WHERE key IN ('catalog_version', 'orders_version')"
+    ).fetchall())
+    return f"{rows.get('catalog_version', 0)}.{rows.get('orders_version', 0)}"
+
+def get_data_version():
+    with connection() as conn:
+        return read_data_version(conn)
+
+def _group_products(products):
+    grouped = {}
+    for p in products:
+        grouped.setdefault(p["name"], []).append(p)
+    return grouped
+
+def _product_views(grouped):
+    # Per-name card data the POS grid needs, computed once per catalog version
+    views = []
+    for name, variants in grouped.items():
+        available = [v for v in variants if v["quantity"] > 0]
+        variant_by_size = {}
+        for v in variants:
+            variant_by_size.setdefault(v["size"], v)
+        views.append({
+            "name": name,
+            "variants": variants,
+            "has_sizes": len(variant_by_size) > 1,
+            "available_sizes": sorted(set(v["size"] for v in available)),
+            "variant_by_size": variant_by_size,
+            "stock_by_size": {size: v["quantity"] for size, v in variant_by_size.items()},
+            "total_stock": sum(v["quantity"] for v in variants),
+            "price": variants[0]["price"],
+            "categories": sorted(set(v["category"] or "" for v in variants) - {""}),
+            "default_variant": available[0] if available else None,
+        })
+    return views
+
+def get_catalog():
+    global _catalog_cache
+    db_name = DB_NAME
     try:
-        c = conn.cursor()
-        if overwrite:
-            c.execute("DELETE FROM products")
-        for _, row in df.iterrows():
-            c.execute("""
-                INSERT INTO products (id, name, category, size, price, quantity)
-                VALUES (?, ?, ?, ?, ?, ?)
-                ON CONFLICT(id) DO UPDATE SET
-                    name=excluded.name,
-                    category=excluded.category,
-                    size=excluded.size,
-                    price=excluded.price,
-                    quantity=excluded.quantity
-            """, (
-                int(row["id"]),
-                row["name"],
-                row.get("category", ""),
-                row.get("size", ""),
-                int(row["price"]),
-                int(row["quantity"])
-            ))
-        conn.commit()
+        version = get_catalog_version()
+        cache = _catalog_cache
+        if cache["db_name"] == db_name and cache["version"] == version:
+            return cache
+        with connection() as conn:
+            # Read the version and the rows from the same snapshot
+            conn.execute("BEGIN")
+            try:
+                version = _read_catalog_version(conn)
+                products = get_products()
+            finally:
+                conn.rollback()
     except Exception as e:
-        logging.error(f"Error uploading products: {str(e)}")
-        conn.rollback()
+        logging.error(f"Error loading catalog: {str(e)}")
         raise
-    finally:
-        conn.close()
+    grouped = _group_products(products)
+    cache = {
+        "db_name": db_name, "version": version, "products": products,
+        "grouped": grouped, "views": _product_views(grouped),
+    }
+    with _catalog_lock:
+        current = _catalog_cache
+        if current["db_name"] != db_name or current["version"] is None or current["version"] < version:
+            _catalog_cache = cache
+    return cache
+
+def get_product_changes(since_version):
+    # Products changed or deleted after catalog version since_version, read in one
+    # snapshot: {"version", "reset", "changed": [product], "deleted": [id]}.
+    # reset means since_version is ahead of this database and the caller should
+    # reload the whole catalog.
+    since_version = int(since_version)
+    with connection() as conn:
+        try:
+            conn.execute("BEGIN")
+            try:
+                version = _read_catalog_version(conn)
+                changed = conn.execute("""
+                    SELECT id, name, category, size, price, quantity FROM products
+                    WHERE row_version > ? ORDER BY id
+                """, (since_version,)).fetchall()
+                deleted = conn.execute(
+                    "SELECT product_id FROM product_tombstones WHERE row_version > ? ORDER BY product_id",
+                    (since_version,)
+                ).fetchall()
+            finally:
+                conn.rollback()
+        except Exception as e:
+            logging.error(f"Error fetching product changes since version {since_version}: {str(e)}")
+            raise
+    columns = ["id", "name", "category", "size", "price", "quantity"]
+    return {
+        "version": version,
+        "reset": since_version > version,
+        "changed": [dict(zip(columns, row)) for row in changed],
+        "deleted": [row[0] for row in deleted],
+    }
+
+# ------------------ Inventory Import ------------------ #
+PRODUCT_COLUMNS = ["id", "name", "category", "size", "price", "quantity"]
+
+def product_rows_from_frame(df):
+    # One vectorized conversion per column, then zip into row tuples
+    n = len(df)
+    def text(col):
+        return df[col].fillna("").astype(str).tolist() if col in df.columns else [""] * n
+    return list(zip(
+        df["id"].astype("int64").tolist(),
+        df["name"].astype(str).tolist(),
+        text("category"),
+        text("size"),
+        df["price"].astype("int64").tolist(),
+        df["quantity"].astype("int64").tolist(),
+    ))
+
+def _stage_product_rows(c, rows):
+    c.execute("""
+    CREATE TEMP TABLE IF NOT EXISTS staged_products (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        category TEXT,
+        size TEXT,
+        price INTEGER NOT NULL,
+        quantity INTEGER NOT NULL
+    )
+    """)
+    c.execute("DELETE FROM staged_products")
+    # Later rows win for a repeated id, as they did with row-by-row upserts
+    c.executemany("INSERT OR REPLACE INTO staged_products VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+def _upsert_staged_products(c):
+    staged = c.execute("SELECT COUNT(*) FROM staged_products").fetchone()[0]
+    inserted = c.execute("""
+        SELECT COUNT(*) FROM staged_products s
+        WHERE NOT EXISTS (SELECT 1 FROM products p WHERE p.id = s.id)
+    """).fetchone()[0]
+    unchanged = c.execute("""
+        SELECT COUNT(*) FROM staged_products s JOIN products p ON p.id = s.id
+        WHERE p.name IS s.name AND p.category IS s.category AND p.size IS s.size
+          AND p.price IS s.price AND p.quantity IS s.quantity
+    """).fetchone()[0]
+    c.execute("""
+        INSERT INTO products (id, name, category, size, price, quantity)
+        SELECT id, name, category, size, price, quantity FROM staged_products WHERE true
+        ON CONFLICT(id) DO UPDATE SET
+            name=excluded.name,
+            category=excluded.category,
+            size=excluded.size,
+            price=excluded.price,
+            quantity=excluded.quantity
+        WHERE products.name IS NOT excluded.name
+           OR products.category IS NOT excluded.category
+           OR products.size IS NOT excluded.size
+           OR products.price IS NOT excluded.price
+           OR products.quantity IS NOT excluded.quantity
+    """)
+    c.execute("DELETE FROM staged_products")
+    return {"inserted": inserted, "updated": staged - inserted - unchanged, "unchanged": unchanged}
+
+def import_product_rows(rows, overwrite=False):
+    with connection() as conn:
+        # Inside a caller's transaction (e.g. a multi-chunk import) leave commit/rollback to it
+        owns_transaction = not conn.in_transaction
+        try:
+            if owns_transaction:
+                conn.execute("BEGIN IMMEDIATE;")
+            c = conn.cursor()
+            if overwrite:
+                c.execute("DELETE FROM products")
+            _stage_product_rows(c, rows)
+            counts = _upsert_staged_products(c)
+            bump_catalog_version(c)
+            if owns_transaction:
+                conn.commit()
+            return counts
+        except Exception as e:
+            logging.error(f"Error uploading products: {str(e)}")
+            if owns_transaction:
+                conn.rollback()
+            raise
+
+def bulk_upload_products(df, overwrite=False):
+    return import_product_rows(product_rows_from_frame(df), overwrite=overwrite)
+
+class InsufficientStockError(ValueError):
+    def __init__(self, shortages):
+        self.shortages = shortages
+        details = []
+        for s in shortages:
+            if s["missing"]:
+                details.append(f"product ID {s['id']} not found")
+            else:
+                label = f"{s['name']} ({s['size']})" if s["size"] else s["name"]
+                details.append(f"{label}: available {s['available']}, requested {s['requested']}")
+        super().__init__(f"Insufficient stock: {'; '.join(details)}")
+
+def _cart_quantities(cart):
+    quantities = {}
+    for item in cart:
+        product_id = int(item["id"])
+        quantities[product_id] = quantities.get(product_id, 0) + int(item["quantity"])
+    return quantities
+
+def _cart_relation(quantities):
+    # VALUES rows as a derived table; a leading WITH would hide cursor.rowcount
+    values = ", ".join("(?, ?)" for _ in quantities)
+    params = [value for pair in quantities.items() for value in pair]
+    return f"(SELECT column1 AS id, column2 AS qty FROM (VALUES {values}))", params
+
+# Units held by other sessions' live holds; a None session counts every hold
+_HELD_BY_OTHERS = """(
+    SELECT COALESCE(SUM(h.quantity), 0) FROM stock_holds h
+    WHERE h.product_id = p.id AND h.expires_at > ? AND h.session_id IS NOT ?
+)"""
+
+def _find_stock_shortages(c, quantities, session_id=None, now=None):
+    cart, params = _cart_relation(quantities)
+    now = time.time() if now is None else now
+    rows = c.execute(f"""
+        SELECT cart.id, p.id IS NULL, p.name, p.size,
+               MAX(COALESCE(p.quantity - {_HELD_BY_OTHERS}, 0), 0) AS available, cart.qty
+        FROM {cart} AS cart LEFT JOIN products p ON p.id = cart.id
+        WHERE p.id IS NULL OR available < cart.qty
+    """, [now, session_id] + params).fetchall()
+    columns = ["id", "missing", "name", "size", "available", "requested"]
+    return [dict(zip(columns, row), missing=bool(row[1])) for row in rows]
+
+def validate_cart(cart, session_id=None):
+    # One lookup for just the cart's products. Returns {"lines": {id: product state},
+    # "errors": [...]} where each error names the product id and a code:
+    # "missing", "insufficient_stock" or "price_changed".
+    quantities = _cart_quantities(cart)
+    if not quantities:
+        return {"lines": {}, "errors": []}
+    cart_rows, params = _cart_relation(quantities)
+    with connection() as conn:
+        p_rows = conn.execute(f"""
+            SELECT cart.id, p.id IS NOT NULL, p.name, p.size, p.price,
+                   MAX(COALESCE(p.quantity - {_HELD_BY_OTHERS}, 0), 0)
+            FROM {cart_rows} AS cart LEFT JOIN products p ON p.id = cart.id
+        """, [time.time(), session_id] + params).fetchall()
+    columns = ["id", "exists", "name", "size", "price", "available"]
+    lines = {row[0]: dict(zip(columns, row), exists=bool(row[1])) for row in p_rows}
+    errors = []
+    for item in cart:
+        product_id = int(item["id"])
+        line = lines[product_id]
+        label = f"{item['name']} ({item['size']})" if item.get("size") else item["name"]
+        if not line["exists"]:
+            errors.append({"id": product_id, "code": "missing", "message": f"{label} is no longer sold"})
+            continue
+        requested = quantities[product_id]
+        if line["available"] < requested:
+            errors.append({
+                "id": product_id, "code": "insufficient_stock", "available": line["available"], "requested": requested,
+                "message": f"{label}: available {line['available']}, requested {requested}"
+            })
+        if line["price"] != item["price"]:
+            errors.append({
+                "id": product_id, "code": "price_changed", "cart_price": item["price"], "price": line["price"],
+                "message": f"{label}: price changed from {item['price']} to {line['price']} EGP"
+            })
+    return {"lines": lines, "errors": errors}
+
+def _write_order(c, cart, total_amount, camper_name, session_id=None):
+    # Caller owns the transaction; nothing here commits.
+    # Stock held by other sessions is off limits; this session's holds become the sale.
+    if not cart:
+        raise ValueError("Cart is empty.")
+    quantities = _cart_quantities(cart)
+    cart_rows, params = _cart_relation(quantities)
+    now = time.time()
+    c.execute("SAVEPOINT stock_update")
+    c.execute(f"""
+        UPDATE products AS p
+        SET quantity = p.quantity - cart.qty
+        FROM {cart_rows} AS cart
+        WHERE cart.id = p.id AND p.quantity - {_HELD_BY_OTHERS} >= cart.qty
+    """, params + [now, session_id])
+    if c.rowcount != len(quantities):
+        # Undo the partial decrement so shortages report the stock actually on hand
+        c.execute("ROLLBACK TO stock_update")
+        c.execute("RELEASE stock_update")
+        raise InsufficientStockError(_find_stock_shortages(c, quantities, session_id, now))
+    c.execute("RELEASE stock_update")
+    if session_id is not None:
+        c.execute(f"""
+            DELETE FROM stock_holds
+            WHERE session_id = ? AND product_id IN (SELECT id FROM {cart_rows})
+        """, [session_id] + params)
+    bump_catalog_version(c)
+
+    created_at = int(now)
+    timestamp = epoch_to_local(created_at).strftime(TIMESTAMP_FORMAT)
+    c.execute("INSERT INTO orders (timestamp, created_at, total, camper_name) VALUES (?, ?, ?, ?)",
+              (timestamp, created_at, total_amount, camper_name or ""))
+    order_id = c.lastrowid
+    c.executemany("""
+        INSERT INTO order_items (order_id, product_id, name, size, price, quantity)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [
+        (order_id, item["id"], item["name"], item.get("size", ""), item["price"], item["quantity"])
+        for item in cart
+    ])
+    _record_sale(c, cart, total_amount, camper_name or "", timestamp[:10])
+    bump_orders_version(c)
+    return order_id
+
+# ------------------ Stock Holds ------------------ #
+# Adding to a cart reserves stock for that session for HOLD_TTL seconds;
+# checkout turns the session's holds into the sale. Expired holds are
+# ignored everywhere and swept on the next reservation.
+HOLD_TTL = 15 * 60
+
+def reserve_stock(session_id, product_id, quantity, ttl=HOLD_TTL):
+    # Sets the session's hold on a product to quantity (its cart total) and
+    # extends the session's other holds; raises InsufficientStockError if short
+    quantity = int(quantity)
+    product_id = int(product_id)
+    with connection() as conn:
+        try:
+            conn.execute("BEGIN IMMEDIATE;")
+            c = conn.cursor()
+            now = time.time()
+            c.execute("DELETE FROM stock_holds WHERE expires_at <= ?", (now,))
+            shortages = _find_stock_shortages(c, {product_id: quantity}, session_id, now)
+            if shortages:
+                raise InsufficientStockError(shortages)
+            if quantity > 0:
+                c.execute("""
+                    INSERT INTO stock_holds (session_id, product_id, quantity, expires_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(session_id, product_id) DO UPDATE SET
+                        quantity = excluded.quantity,
+                        expires_at = excluded.expires_at
+                """, (session_id, product_id, quantity, now + ttl))
+            else:
+                c.execute("DELETE FROM stock_holds WHERE session_id = ? AND product_id = ?", (session_id, product_id))
+            c.execute("UPDATE stock_holds SET expires_at = ? WHERE session_id = ?", (now + ttl, session_id))
+            conn.commit()
+        except Exception as e:
+            logging.error(f"Reserving stock for product ID {product_id} failed: {str(e)}")
+            conn.rollback()
+            raise
 
-def save_order(cart, total_amount, conn, camper_name=None):
+def release_holds(session_id, product_ids=None):
+    # Drops the session's holds, or only those on product_ids
+    with connection() as conn:
+        try:
+            if product_ids is None:
+                conn.execute("DELETE FROM stock_holds WHERE session_id = ?", (session_id,))
+            else:
+                ids = [int(product_id) for product_id in product_ids]
+                if ids:
+                    placeholders = ", ".join("?" for _ in ids)
+                    conn.execute(
+                        f"DELETE FROM stock_holds WHERE session_id = ? AND product_id IN ({placeholders})",
+                        [session_id] + ids
+                    )
+            conn.commit()
+        except Exception as e:
+            logging.error(f"Releasing stock holds failed: {str(e)}")
+            conn.rollback()
+            raise
+
+def expire_holds():
+    with connection() as conn:
+        try:
+            removed = conn.execute("DELETE FROM stock_holds WHERE expires_at <= ?", (time.time(),)).rowcount
+            conn.commit()
+            return removed
+        except Exception as e:
+            logging.error(f"Expiring stock holds failed: {str(e)}")
+            conn.rollback()
+            raise
+
+def get_session_holds(session_id):
+    # Live holds of one session as {product_id: quantity}
+    with connection() as conn:
+        rows = conn.execute(
+            "SELECT product_id, quantity FROM stock_holds WHERE session_id = ? AND expires_at > ?",
+            (session_id, time.time())
+        ).fetchall()
+        return dict(rows)
+
+# ------------------ Sales Aggregates ------------------ #
+# daily_sales, camper_totals and product_sales are updated in the same
+# transaction as the order. An order counts at its item total, or at the
+# stored total when it has no priced items (same rule as the reports).
+# ORDER_TOTAL_SQL is that rule in SQL for an orders row aliased o; format it
+# with the order_items relation to read from.
+ORDER_TOTAL_SQL = """COALESCE(NULLIF(
+    (SELECT SUM(x.price * x.quantity) FROM {order_items} x WHERE x.order_id = o.id), 0
+), o.total)"""
+
+def _record_sale(c, cart, total_amount, camper_name, day):
+    items_total = sum(item["price"] * item["quantity"] for item in cart)
+    order_total = items_total if items_total else total_amount
+    c.execute("""
+        INSERT INTO daily_sales (day, order_count, total) VALUES (?, 1, ?)
+        ON CONFLICT(day) DO UPDATE SET
+            order_count = order_count + 1,
+            total = total + excluded.total
+    """, (day, order_total))
+    c.execute("""
+        INSERT INTO camper_totals (camper_name, order_count, total) VALUES (?, 1, ?)
+        ON CONFLICT(camper_name) DO UPDATE SET
+            order_count = order_count + 1,
+            total = total + excluded.total
+    """, (camper_name, order_total))
+    sold = {}
+    for item in cart:
+        entry = sold.setdefault(int(item["id"]), [item["name"], item.get("size", ""), 0, 0])
+        entry[2] += item["quantity"]
+        entry[3] += item["price"] * item["quantity"]
+    c.executemany("""
+        INSERT INTO product_sales (product_id, name, size, quantity, revenue) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(product_id) DO UPDATE SET
+            name = excluded.name,
+            size = excluded.size,
+            quantity = quantity + excluded.quantity,
+            revenue = revenue + excluded.revenue
+    """, [(product_id, *entry) for product_id, entry in sold.items()])
+
+def _rebuild_sales_aggregates(c, orders="orders", order_items="order_items"):
+    c.execute("DELETE FROM daily_sales")
+    c.execute("DELETE FROM camper_totals")
+    c.execute("DELETE FROM product_sales")
+    order_totals = f"""
+        WITH item_totals AS (
+            SELECT order_id, SUM(price * quantity) AS items_total
+            FROM {order_items} GROUP BY order_id
+        ),
+        order_totals AS (
+            SELECT o.id, substr(o.timestamp, 1, 10) AS day, o.camper_name,
+                   CASE WHEN COALESCE(i.items_total, 0) != 0 THEN i.items_total ELSE o.total END AS total
+            FROM {orders} o LEFT JOIN item_totals i ON i.order_id = o.id
+        )
+    """
+    c.execute(order_totals + """
+        INSERT INTO daily_sales (day, order_count, total)
+        SELECT day, COUNT(*), SUM(total) FROM order_totals GROUP BY day
+    """)
+    c.execute(order_totals + """
+        INSERT INTO camper_totals (camper_name, order_count, total)
+        SELECT camper_name, COUNT(*), SUM(total) FROM order_totals
+        WHERE camper_name IS NOT NULL GROUP BY camper_name
+    """)
+    c.execute(f"""
+        INSERT INTO product_sales (product_id, name, size, quantity, revenue)
+        SELECT product_id, name, size, SUM(quantity), SUM(price * quantity)
+        FROM {order_items} WHERE product_id IS NOT NULL GROUP BY product_id
+    """)
+
+def rebuild_sales_aggregates():
+    # Summaries cover archived periods too, so the archives are read as well
+    with connection() as conn, order_sources(conn, include_archived=True) as (orders, order_items):
+        try:
+            conn.execute("BEGIN IMMEDIATE;")
+            _rebuild_sales_aggregates(conn.cursor(), orders, order_items)
+            conn.commit()
+        except Exception as e:
+            logging.error(f"Rebuilding sales aggregates failed: {str(e)}")
+            conn.rollback()
+            raise
+
+def get_daily_sales():
+    with connection() as conn:
+        try:
+            cursor = conn.execute("SELECT day, order_count, total FROM daily_sales ORDER BY day")
+            columns = ["day", "order_count", "total"]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except Exception as e:
+            logging.error(f"Error fetching daily sales: {str(e)}")
+            raise
+
+def get_camper_totals():
+    with connection() as conn:
+        try:
+            cursor = conn.execute("SELECT camper_name, order_count, total FROM camper_totals ORDER BY camper_name")
+            columns = ["camper_name", "order_count", "total"]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except Exception as e:
+            logging.error(f"Error fetching camper totals: {str(e)}")
+            raise
+
+def get_product_sales():
+    with connection() as conn:
+        try:
+            cursor = conn.execute(
+                "SELECT product_id, name, size, quantity, revenue FROM product_sales ORDER BY revenue DESC"
+            )
+            columns = ["product_id", "name", "size", "quantity", "revenue"]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except Exception as e:
+            logging.error(f"Error fetching product sales: {str(e)}")
+            raise
+
+def save_order(cart, total_amount, conn, camper_name=None, session_id=None):
     try:
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        c = conn.cursor()
-        c.execute("INSERT INTO orders (timestamp, total, camper_name) VALUES (?, ?, ?)", 
-                  (timestamp, total_amount, camper_name or ""))
-        order_id = c.lastrowid
-        for item in cart:
-            c.execute("""
-                INSERT INTO order_items (order_id, product_id, name, size, price, quantity)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                order_id,
-                item["id"],
-                item["name"],
-                item.get("size", ""),
-                item["price"],
-                item["quantity"]
-            ))
-            update_product_quantity(item["id"], item["quantity"], conn)
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE;")
+        order_id = _write_order(conn.cursor(), cart, total_amount, camper_name, session_id)
         conn.commit()
         return order_id
+    except InsufficientStockError as e:
+        logging.error(f"Order save failed: {str(e)}")
+        conn.rollback()
+        raise
     except Exception as e:
         logging.error(f"Order save failed: {str(e)}")
         conn.rollback()
         raise Exception(f"Order save failed: {str(e)}")
 
-def get_order_history():
-    conn = get_connection()
-    try:
-        cursor = conn.execute("SELECT id, timestamp, total, camper_name FROM orders ORDER BY id DESC")
-        rows = cursor.fetchall()
-        columns = ["id", "timestamp", "total", "camper_name"]
-        return [dict(zip(columns, row)) for row in rows]
-    except Exception as e:
-        logging.error(f"Error fetching order history: {str(e)}")
-        raise
-    finally:
-        conn.close()
+# ------------------ Checkout Queue ------------------ #
+# Tills submit orders here instead of writing themselves. A single writer
+# thread drains whatever is pending and commits it as one transaction, so
+# concurrent checkouts queue up instead of fighting over the SQLite lock.
+CHECKOUT_BATCH_MAX = 50  # orders committed per transaction at most
+CHECKOUT_LOCK_RETRIES = 5
+
+_checkout_queue = queue.Queue()
+_checkout_writer = None
+_checkout_writer_lock = threading.Lock()
+
+def submit_order(cart, total_amount, camper_name=None, session_id=None):
+    # session_id converts that session's stock holds into the sale
+    future = Future()
+    _ensure_checkout_writer()
+    _checkout_queue.put((list(cart), total_amount, camper_name, session_id, future))
+    return future
+
+def _ensure_checkout_writer():
+    global _checkout_writer
+    with _checkout_writer_lock:
+        if _checkout_writer is None or not _checkout_writer.is_alive():
+            _checkout_writer = threading.Thread(target=_checkout_writer_loop, name="checkout-writer", daemon=True)
+            _checkout_writer.start()
+
+def _checkout_writer_loop():
+    while True:
+        batch = [_checkout_queue.get()]
+        while len(batch) < CHECKOUT_BATCH_MAX:
+            try:
+                batch.append(_checkout_queue.get_nowait())
+            except queue.Empty:
+                break
+        jobs = [job for job in batch if job[-1].set_running_or_notify_cancel()]
+        if jobs:
+            _commit_checkout_batch(jobs)
+
+def _commit_checkout_batch(jobs):
+    started = time.perf_counter()
+    for attempt in range(1, CHECKOUT_LOCK_RETRIES + 1):
+        try:
+            results = _write_checkout_batch(jobs)
+            break
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e).lower() and attempt < CHECKOUT_LOCK_RETRIES:
+                logging.warning(f"Checkout batch hit a locked database, retry {attempt}")
+                instrumentation.increment("checkout lock retries")
+                time.sleep(0.05 * attempt)
+                continue
+            logging.error(f"Checkout batch failed: {str(e)}")
+            results = [e] * len(jobs)
+            break
+        except Exception as e:
+            logging.error(f"Checkout batch failed: {str(e)}")
+            results = [e] * len(jobs)
+            break
+    instrumentation.record("checkout batch", time.perf_counter() - started, rows=len(jobs))
+    instrumentation.increment("checkout orders", len(jobs))
+    instrumentation.increment("checkout failures", sum(isinstance(result, Exception) for result in results))
+    for (*_, future), result in zip(jobs, results):
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+def _write_checkout_batch(jobs):
+    results = []
+    with connection() as conn:
+        conn.execute("BEGIN IMMEDIATE;")
+        c = conn.cursor()
+        for cart, total_amount, camper_name, session_id, _ in jobs:
+            # A short or invalid order only rolls back its own savepoint
+            c.execute("SAVEPOINT checkout_order")
+            try:
+                results.append(_write_order(c, cart, total_amount, camper_name, session_id))
+                c.execute("RELEASE checkout_order")
+            except Exception as e:
+                if isinstance(e, sqlite3.OperationalError) and "locked" in str(e).lower():
+                    raise  # the whole batch is retried
+                logging.error(f"Order save failed: {str(e)}")
+                c.execute("ROLLBACK TO checkout_order")
+                c.execute("RELEASE checkout_order")
+                results.append(e)
+        conn.commit()
+    return results
+
+def get_order_history(include_archived=False):
+    with connection() as conn, order_sources(conn, include_archived) as (orders, _):
+        try:
+            cursor = conn.execute(f"SELECT id, timestamp, created_at, total, camper_name FROM {orders} ORDER BY id DESC")
+            rows = cursor.fetchall()
+            columns = ["id", "timestamp", "created_at", "total", "camper_name"]
+            return [dict(zip(columns, row)) for row in rows]
+        except Exception as e:
+            logging.error(f"Error fetching order history: {str(e)}")
+            raise
+
+# ------------------ Order History Pages ------------------ #
+ORDER_PAGE_SIZE = 50
+
+def get_orders_page(limit=ORDER_PAGE_SIZE, before_id=None, start_date=None, end_date=None,
+                    camper_name=None, min_total=None, max_total=None, include_archived=False):
+    # Keyset pagination on id: pass the returned next_before_id to fetch the following page.
+    # Dates are inclusive local dates, matched as an epoch range on created_at.
+    conditions, params = _created_at_conditions(start_date, end_date)
+    if before_id is not None:
+        conditions.append("o.id < ?")
+        params.append(int(before_id))
+    if camper_name:
+        conditions.append("o.camper_name LIKE ?")
+        params.append(f"%{camper_name}%")
+    if min_total is not None:
+        conditions.append("order_total >= ?")
+        params.append(min_total)
+    if max_total is not None:
+        conditions.append("order_total <= ?")
+        params.append(max_total)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    with connection() as conn, order_sources(conn, include_archived) as (orders, order_items):
+        try:
+            cursor = conn.execute(f"""
+                SELECT id, timestamp, created_at, order_total, camper_name FROM (
+                    SELECT o.id, o.timestamp, o.created_at, o.camper_name,
+                           {ORDER_TOTAL_SQL.format(order_items=order_items)} AS order_total
+                    FROM {orders} o
+                ) o
+                {where}
+                ORDER BY o.id DESC
+                LIMIT ?
+            """, params + [limit + 1])
+            rows = cursor.fetchall()
+        except Exception as e:
+            logging.error(f"Error fetching orders page: {str(e)}")
+            raise
+    columns = ["id", "timestamp", "created_at", "total", "camper_name"]
+    orders = [dict(zip(columns, row)) for row in rows[:limit]]
+    next_before_id = orders[-1]["id"] if len(rows) > limit else None
+    return orders, next_before_id
+
+def get_items_for_orders(order_ids, include_archived=False):
+    order_ids = [int(order_id) for order_id in order_ids]
+    if not order_ids:
+        return []
+    placeholders = ", ".join("?" for _ in order_ids)
+    with connection() as conn, order_sources(conn, include_archived, order_ids) as (_, order_items):
+        try:
+            cursor = conn.execute(f"""
+                SELECT order_id, product_id, name, size, price, quantity FROM {order_items}
+                WHERE order_id IN ({placeholders})
+                ORDER BY order_id DESC, id
+            """, order_ids)
+            columns = ["order_id", "product_id", "name", "size", "price", "quantity"]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except Exception as e:
+            logging.error(f"Error fetching items for orders: {str(e)}")
+            raise
+
+def get_sales_by_period(start_date, end_date, period="day", include_archived=False):
+    # Order count and total per local day/week (or one session bucket), bucketed in SQL
+    # by joining the DST-correct boundaries to an index range scan on created_at
+    bounds = period_bounds(start_date, end_date, period)
+    if not bounds:
+        return []
+    values = ", ".join("(?, ?, ?)" for _ in bounds)
+    params = [value for bound in bounds for value in bound]
+    with connection() as conn, order_sources(conn, include_archived) as (orders, order_items):
+        try:
+            cursor = conn.execute(f"""
+                SELECT b.column1, b.column2, b.column3, COUNT(o.id), COALESCE(SUM(o.order_total), 0)
+                FROM (VALUES {values}) AS b
+                LEFT JOIN (
+                    SELECT o.id, o.created_at,
+                           {ORDER_TOTAL_SQL.format(order_items=order_items)} AS order_total
+                    FROM {orders} o WHERE o.created_at >= ? AND o.created_at < ?
+                ) o ON o.created_at >= b.column2 AND o.created_at < b.column3
+                GROUP BY b.column1, b.column2, b.column3
+                ORDER BY b.column2
+            """, params + [bounds[0][1], bounds[-1][2]])
+            columns = ["period", "start", "end", "order_count", "total"]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except Exception as e:
+            logging.error(f"Error fetching sales by {period}: {str(e)}")
+            raise
+
+# ------------------ Camper Search ------------------ #
+CAMPER_SEARCH_LIMIT = 100
+
+def _has_camper_fts(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'orders_fts'").fetchone() is not None
+
+def _like_prefix(text):
+    return text.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+def _camper_match_query(text):
+    # Every word must match as a prefix: "ann sm" finds "Ann Smith"
+    tokens = re.findall(r"\w+", text)
+    return " ".join(f'"{token}"*' for token in tokens)
 
-def get_order_items(order_id):
-    conn = get_connection()
+def search_orders_by_camper(text, limit=CAMPER_SEARCH_LIMIT):
+    # Matching orders (newest first) with their items, from a single query
+    match = _camper_match_query(text)
+    if not match:
+        return []
+    with connection() as conn:
+        try:
+            if _has_camper_fts(conn):
+                matched = """
+                    SELECT o.id, o.timestamp, o.created_at, o.total, o.camper_name
+                    FROM orders_fts JOIN orders o ON o.id = orders_fts.rowid
+                    WHERE orders_fts MATCH ?
+                    ORDER BY o.id DESC LIMIT ?
+                """
+                params = (match, limit)
+            else:
+                matched = """
+                    SELECT id, timestamp, created_at, total, camper_name FROM orders
+                    WHERE camper_name LIKE ? ESCAPE '\\' ORDER BY id DESC LIMIT ?
+                """
+                params = (_like_prefix(text), limit)
+            rows = conn.execute(f"""
+                WITH matched AS ({matched})
+                SELECT m.id, m.timestamp, m.created_at, m.total, m.camper_name,
+                       i.product_id, i.name, i.size, i.price, i.quantity
+                FROM matched m LEFT JOIN order_items i ON i.order_id = m.id
+                ORDER BY m.id DESC, i.id
+            """, params).fetchall()
+        except Exception as e:
+            logging.error(f"Error searching orders for camper {text!r}: {str(e)}")
+            raise
+    orders = {}
+    for order_id, timestamp, created_at, total, camper_name, product_id, name, size, price, quantity in rows:
+        order = orders.setdefault(order_id, {
+            "id": order_id, "timestamp": timestamp, "created_at": created_at, "total": total,
+            "camper_name": camper_name, "items": []
+        })
+        if product_id is not None:
+            order["items"].append({
+                "product_id": product_id, "name": name, "size": size, "price": price, "quantity": quantity
+            })
+    for order in orders.values():
+        items_total = sum(item["price"] * item["quantity"] for item in order["items"])
+        if items_total:
+            order["total"] = items_total
+    return list(orders.values())
+
+def suggest_camper_names(prefix, limit=10):
+    # camper_totals has one row per camper, so this stays fast however long the history is
+    if not prefix.strip():
+        return []
+    with connection() as conn:
+        try:
+            cursor = conn.execute("""
+                SELECT camper_name FROM camper_totals
+                WHERE camper_name LIKE ? ESCAPE '\\' AND camper_name != ''
+                ORDER BY order_count DESC, camper_name LIMIT ?
+            """, (_like_prefix(prefix), limit))
+            return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            logging.error(f"Error suggesting camper names for {prefix!r}: {str(e)}")
+            raise
+
+def get_order_items(order_id, include_archived=False):
+    with connection() as conn, order_sources(conn, include_archived, [order_id]) as (_, order_items):
+        try:
+            cursor = conn.execute(
+                f"SELECT product_id, name, size, price, quantity FROM {order_items} WHERE order_id = ?",
+                (order_id,)
+            )
+            rows = cursor.fetchall()
+            columns = ["product_id", "name", "size", "price", "quantity"]
+            return [dict(zip(columns, row)) for row in rows]
+        except Exception as e:
+            logging.error(f"Error fetching order items for order {order_id}: {str(e)}")
+            raise
+
+def get_order(order_id, include_archived=False):
+    # One order with its items, or None
+    order_id = int(order_id)
+    with connection() as conn, order_sources(conn, include_archived, [order_id]) as (orders, order_items):
+        try:
+            row = conn.execute(
+                f"SELECT id, timestamp, created_at, total, camper_name FROM {orders} WHERE id = ?", (order_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            items = conn.execute(
+                f"SELECT product_id, name, size, price, quantity FROM {order_items} WHERE order_id = ? ORDER BY id",
+                (order_id,)
+            ).fetchall()
+        except Exception as e:
+            logging.error(f"Error fetching order {order_id}: {str(e)}")
+            raise
+    order = dict(zip(["id", "timestamp", "created_at", "total", "camper_name"], row))
+    order["items"] = [dict(zip(["product_id", "name", "size", "price", "quantity"], item)) for item in items]
+    return order
+
+# ------------------ Order Archives ------------------ #
+# Closed periods move out of orders/order_items into their own SQLite file
+# under data/archives, registered in order_archives. Queries that pass
+# include_archived=True attach the archives and read live and archived rows
+# through temp views. Sales summaries keep counting archived orders.
+ARCHIVE_DIR = os.path.join("data", "archives")  # relative to the database file
+ARCHIVE_ALIAS = "archive_{}"
+
+def _archive_dir():
+    return os.path.join(os.path.dirname(os.path.abspath(DB_NAME)), ARCHIVE_DIR)
+
+def list_archives():
+    with connection() as conn:
+        cursor = conn.execute("""
+            SELECT name, file_name, first_id, last_id, first_timestamp, last_timestamp, order_count, archived_at
+            FROM order_archives ORDER BY first_id
+        """)
+        columns = ["name", "file_name", "first_id", "last_id", "first_timestamp", "last_timestamp",
+                   "order_count", "archived_at"]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def _attach_limit(conn):
+    # Databases SQLite lets one connection attach at once (10 unless compiled otherwise)
+    return conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+
+_ORDER_COLUMNS = "id, timestamp, created_at, total, camper_name"
+_ORDER_ITEM_COLUMNS = "id, order_id, product_id, name, size, price, quantity"
+
+def _copy_archives(conn, archives, group_size):
+    # Loads the archives into temp tables a group at a time, for when there are
+    # more than can be attached together. Returns the temp (orders, order_items).
+    conn.execute(f"CREATE TEMP TABLE archived_orders AS SELECT {_ORDER_COLUMNS} FROM main.orders WHERE false")
+    conn.execute(f"CREATE TEMP TABLE archived_order_items AS SELECT {_ORDER_ITEM_COLUMNS} FROM main.order_items WHERE false")
+    for start in range(0, len(archives), group_size):
+        aliases = []
+        try:
+            for i, file_name in enumerate(archives[start:start + group_size]):
+                alias = ARCHIVE_ALIAS.format(i)
+                conn.execute(f"ATTACH DATABASE ? AS {alias}", (os.path.join(_archive_dir(), file_name),))
+                aliases.append(alias)
+            for alias in aliases:
+                conn.execute(f"INSERT INTO temp.archived_orders SELECT {_ORDER_COLUMNS} FROM {alias}.orders")
+                conn.execute(f"INSERT INTO temp.archived_order_items SELECT {_ORDER_ITEM_COLUMNS} FROM {alias}.order_items")
+            conn.commit()  # only temp was written; DETACH needs the transaction closed
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            for alias in aliases:
+                conn.execute(f"DETACH DATABASE {alias}")
+    conn.execute("CREATE INDEX temp.idx_archived_orders_created_at ON archived_orders(created_at)")
+    conn.execute("CREATE INDEX temp.idx_archived_order_items_order ON archived_order_items(order_id)")
+    return ["temp.archived_orders"], ["temp.archived_order_items"]
+
+@contextmanager
+def order_sources(conn, include_archived=False, order_ids=None):
+    # Yields the (orders, order_items) relations to read from. With archives these are
+    # temp views over main and each attached archive; order_ids limits which archives
+    # are attached to those whose id range covers them. Past SQLite's attach limit the
+    # archives are copied into temp tables instead, which is slower but unlimited.
+    archives = []
+    if include_archived:
+        sql = """
+            SELECT file_name, first_id, last_id FROM order_archives
+            WHERE first_id IS NOT NULL AND last_id IS NOT NULL ORDER BY first_id
+        """
+        archives = [
+            file_name for file_name, first_id, last_id in conn.execute(sql).fetchall()
+            if order_ids is None or any(first_id <= int(order_id) <= last_id for order_id in order_ids)
+        ]
+    if not archives:
+        yield "orders", "order_items"
+        return
+    if conn.in_transaction:
+        raise sqlite3.OperationalError("Archived orders can't be attached inside a transaction")
+    aliases = []
+    copied = False
     try:
-        cursor = conn.execute(
-            "SELECT product_id, name, size, price, quantity FROM order_items WHERE order_id = ?",
-            (order_id,)
+        if len(archives) <= _attach_limit(conn):
+            for i, file_name in enumerate(archives):
+                alias = ARCHIVE_ALIAS.format(i)
+                conn.execute(f"ATTACH DATABASE ? AS {alias}", (os.path.join(_archive_dir(), file_name),))
+                aliases.append(alias)
+            order_tables = [f"{alias}.orders" for alias in aliases]
+            item_tables = [f"{alias}.order_items" for alias in aliases]
+        else:
+            copied = True
+            order_tables, item_tables = _copy_archives(conn, archives, _attach_limit(conn))
+        orders = " UNION ALL ".join(
+            f"SELECT {_ORDER_COLUMNS} FROM {table}" for table in ["main.orders"] + order_tables
         )
-        rows = cursor.fetchall()
-        columns = ["product_id", "name", "size", "price", "quantity"]
-        return [dict(zip(columns, row)) for row in rows]
-    except Exception as e:
-        logging.error(f"Error fetching order items for order {order_id}: {str(e)}")
-        raise
+        items = " UNION ALL ".join(
+            f"SELECT {_ORDER_ITEM_COLUMNS} FROM {table}" for table in ["main.order_items"] + item_tables
+        )
+        conn.execute(f"CREATE TEMP VIEW all_orders AS {orders}")
+        conn.execute(f"CREATE TEMP VIEW all_order_items AS {items}")
+        yield "all_orders", "all_order_items"
     finally:
-        conn.close()
+        if conn.in_transaction:
+            conn.rollback()
+        conn.execute("DROP VIEW IF EXISTS temp.all_orders")
+        conn.execute("DROP VIEW IF EXISTS temp.all_order_items")
+        if copied:
+            conn.execute("DROP TABLE IF EXISTS temp.archived_orders")
+            conn.execute("DROP TABLE IF EXISTS temp.archived_order_items")
+        for alias in aliases:
+            conn.execute(f"DETACH DATABASE {alias}")
+
+def _create_archive_schema(c, schema):
+    c.execute(f"""
+    CREATE TABLE IF NOT EXISTS {schema}.orders (
+        id INTEGER PRIMARY KEY,
+        timestamp TEXT NOT NULL,
+        created_at INTEGER,
+        total INTEGER NOT NULL,
+        camper_name TEXT
+    )
+    """)
+    c.execute(f"""
+    CREATE TABLE IF NOT EXISTS {schema}.order_items (
+        id INTEGER PRIMARY KEY,
+        order_id INTEGER,
+        product_id INTEGER,
+        name TEXT,
+        size TEXT,
+        price INTEGER,
+        quantity INTEGER
+    )
+    """)
+    c.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_order_items_order ON order_items(order_id)")
+    c.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_orders_created_at ON orders(created_at)")
+
+def archive_orders(name, end_date, start_date=None, vacuum=False):
+    # Moves orders dated start_date..end_date (inclusive) into data/archives/<name>.db.
+    # Archiving into an existing name adds to that archive. Returns the number moved.
+    if not re.fullmatch(r"[\w-]+", name):
+        raise ValueError("Archive names may only contain letters, digits, '_' and '-'.")
+    conditions, params = _created_at_conditions(start_date, end_date)
+    where = " AND ".join(conditions)
+    file_name = f"{name}.db"
+    os.makedirs(_archive_dir(), exist_ok=True)
+    with connection() as conn:
+        if conn.in_transaction:
+            raise sqlite3.OperationalError("Orders can't be archived inside a transaction")
+        conn.execute("ATTACH DATABASE ? AS archive", (os.path.join(_archive_dir(), file_name),))
+        try:
+            # Two transactions that each write one file: SQLite doesn't commit main (WAL)
+            # and an attached database atomically. The copy commits first, so a crash
+            # in between only leaves duplicates, which the next run overwrites.
+            conn.execute("BEGIN IMMEDIATE;")
+            c = conn.cursor()
+            _create_archive_schema(c, "archive")
+            c.execute(f"""
+                INSERT OR REPLACE INTO archive.orders (id, timestamp, created_at, total, camper_name)
+                SELECT o.id, o.timestamp, o.created_at, o.total, o.camper_name FROM main.orders o WHERE {where}
+            """, params)
+            c.execute(f"""
+                INSERT OR REPLACE INTO archive.order_items (id, order_id, product_id, name, size, price, quantity)
+                SELECT i.id, i.order_id, i.product_id, i.name, i.size, i.price, i.quantity
+                FROM main.orders o JOIN main.order_items i ON i.order_id = o.id WHERE {where}
+            """, params)
+            conn.commit()
+
+            # Only orders the archive now holds leave main
+            conn.execute("BEGIN IMMEDIATE;")
+            archived = f"SELECT o.id FROM main.orders o WHERE {where} AND o.id IN (SELECT id FROM archive.orders)"
+            c.execute(f"DELETE FROM main.order_items WHERE order_id IN ({archived})", params)
+            c.execute(f"DELETE FROM main.orders WHERE id IN ({archived})", params)
+            moved = c.rowcount
+            empty = not c.execute("SELECT EXISTS (SELECT 1 FROM archive.orders)").fetchone()[0]
+            if moved:
+                c.execute("""
+                    INSERT INTO order_archives
+                        (name, file_name, first_id, last_id, first_timestamp, last_timestamp, order_count, archived_at)
+                    SELECT ?, ?, MIN(id), MAX(id), MIN(timestamp), MAX(timestamp), COUNT(*), ? FROM archive.orders WHERE true
+                    ON CONFLICT(name) DO UPDATE SET
+                        first_id = excluded.first_id,
+                        last_id = excluded.last_id,
+                        first_timestamp = excluded.first_timestamp,
+                        last_timestamp = excluded.last_timestamp,
+                        order_count = excluded.order_count,
+                        archived_at = excluded.archived_at
+                """, (name, file_name, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+                bump_orders_version(c)
+            elif empty:
+                # Nothing was in range: an archive with no id range must not be registered
+                c.execute("DELETE FROM order_archives WHERE name = ?", (name,))
+            conn.commit()
+        except Exception as e:
+            logging.error(f"Archiving orders into {file_name} failed: {str(e)}")
+            conn.rollback()
+            raise
+        finally:
+            conn.execute("DETACH DATABASE archive")
+        if not moved and empty:
+            os.remove(os.path.join(_archive_dir(), file_name))
+        if vacuum:
+            # Hands the freed pages back to the filesystem
+            conn.execute("VACUUM")
+    logging.info(f"Archived {moved} orders into {file_name}")
+    return moved
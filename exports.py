@@ -0,0 +1,316 @@
+import csv
+import importlib.util
+import io
+import logging
+import os
+import tempfile
+import threading
+import zipfile
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from database import ORDER_TOTAL_SQL, STORE_TIMEZONE, _created_at_conditions, connection, read_data_version
+
+EXPORT_DIR = os.path.join("data", "exports")
+EXCEL_MAX_ROWS = 1048576  # per sheet, including the header row
+
+_ORDER_TOTAL = ORDER_TOTAL_SQL.format(order_items="order_items")
+
+_export_lock = threading.Lock()
+
+def available_excel_engine():
+    # Looked up without importing, so pages can offer xlsx without loading openpyxl
+    return "openpyxl" if importlib.util.find_spec("openpyxl") else None
+
+def _local_time(created_at):
+    # created_at is UTC epoch seconds
+    if created_at is None:
+        return None
+    return datetime.fromtimestamp(created_at, ZoneInfo(STORE_TIMEZONE))
+
+def _orders_rows(conn):
+    cursor = conn.execute(f"""
+        SELECT o.id, o.created_at,
+               {_ORDER_TOTAL},
+               o.camper_name
+        FROM orders o ORDER BY o.id DESC
+    """)
+    for order_id, created_at, total, camper_name in cursor:
+        local = _local_time(created_at)
+        yield (
+            order_id,
+            local.strftime("%Y-%m-%d") if local else None,
+            local.strftime("%H:%M:%S") if local else None,
+            round(total or 0, 2),
+            camper_name,
+        )
+
+def _combined_receipts_rows(conn):
+    # One ordered join; header rows are emitted whenever the order id changes
+    cursor = conn.execute(f"""
+        SELECT o.id, o.created_at, o.camper_name,
+               {_ORDER_TOTAL},
+               i.name, i.price, i.quantity
+        FROM orders o LEFT JOIN order_items i ON i.order_id = o.id
+        ORDER BY o.id DESC, i.id
+    """)
+    current = None
+    for order_id, created_at, camper_name, total, name, price, quantity in cursor:
+        if order_id != current:
+            current = order_id
+            local = _local_time(created_at)
+            yield ("Header", "Order ID", order_id)
+            yield ("Header", "Timestamp", local.strftime("%Y-%m-%d %H:%M:%S") if local else None)
+            yield ("Header", "Total", f"{total or 0:.2f} EGP")
+            yield ("Header", "Camper Name", camper_name)
+            yield ("Items", "", "")  # Separator for items
+        if name is not None:
+            price = float(price or 0)
+            quantity = int(quantity or 0)
+            yield ("Items", name, f"{quantity} x {price:.2f} = {price * quantity:.2f}")
+
+def camper_summary_rows(conn):
+    # Also the Receipts page's camper summary, via the report snapshot
+    return conn.execute("""
+        WITH item_lines AS (
+            SELECT order_id,
+                   group_concat(name || ' (' || quantity || ' x ' || printf('%.2f', price)
+                                || ' = ' || printf('%.2f', price * quantity) || ')', '; ') AS items,
+                   SUM(price * quantity) AS items_total
+            FROM (SELECT * FROM order_items ORDER BY order_id DESC, id)
+            GROUP BY order_id
+        ),
+        camper_orders AS (
+            SELECT o.id, o.camper_name, COALESCE(NULLIF(l.items_total, 0), o.total) AS total, l.items
+            FROM orders o LEFT JOIN item_lines l ON l.order_id = o.id
+            WHERE o.camper_name IS NOT NULL
+            ORDER BY o.camper_name, o.id DESC
+        )
+        SELECT camper_name, ROUND(SUM(total), 2), group_concat(id, ', '),
+               COALESCE(group_concat(items, '; '), 'No items')
+        FROM camper_orders GROUP BY camper_name ORDER BY camper_name
+    """)
+
+CAMPER_SUMMARY_COLUMNS = ["Camper Name", "Total Paid (EGP)", "Order IDs", "Items Ordered"]
+
+def _query(sql):
+    return lambda conn: conn.execute(sql)
+
+# (sheet name, csv name, header, rows); each query only runs when its sheet is written
+EXPORT_TABLES = [
+    ("Orders", "orders.csv", ["id", "date", "time", "total", "camper_name"], _orders_rows),
+    ("OrderItems", "order_items.csv",
+     ["id", "order_id", "product_id", "name", "size", "price", "quantity", "line_total"],
+     _query("""
+        SELECT id, order_id, product_id, name, size, price, quantity, price * quantity
+        FROM order_items ORDER BY order_id DESC, id
+     """)),
+    ("Inventory", "inventory.csv", ["id", "name", "category", "size", "price", "quantity"],
+     _query("SELECT id, name, category, size, price, quantity FROM products ORDER BY id")),
+    ("DailyTotals", "daily_totals.csv", ["date", "orders", "daily_total"],
+     _query("SELECT day, order_count, ROUND(total, 2) FROM daily_sales ORDER BY day")),
+    ("Combined Receipts", "combined_receipts.csv", ["Section", "Field", "Value"], _combined_receipts_rows),
+    ("Camper Summary", "camper_summary.csv", CAMPER_SUMMARY_COLUMNS, camper_summary_rows),
+]
+
+def _write_xlsx(path, conn):
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    for sheet_name, _, header, rows in EXPORT_TABLES:
+        part = 1
+        sheet = workbook.create_sheet(sheet_name[:31])
+        sheet.append(header)
+        written = 1
+        for row in rows(conn):
+            if written == EXCEL_MAX_ROWS:
+                # Spill very long tables onto continuation sheets
+                part += 1
+                sheet = workbook.create_sheet(f"{sheet_name[:26]} ({part})")
+                sheet.append(header)
+                written = 1
+            sheet.append(list(row))
+            written += 1
+    workbook.save(path)
+
+def _write_zip(path, conn):
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as z:
+        for _, csv_name, header, rows in EXPORT_TABLES:
+            with z.open(csv_name, "w") as raw, io.TextIOWrapper(raw, encoding="utf-8", newline="") as text:
+                writer = csv.writer(text)
+                writer.writerow(header)
+                writer.writerows(rows(conn))
+
+def _cached_export_path(fmt, version):
+    return os.path.join(EXPORT_DIR, f"full_export_{version}.{fmt}")
+
+def full_export(fmt=None):
+    # Returns the path of a full export for the current data version, building it only when missing
+    fmt = fmt or ("xlsx" if available_excel_engine() else "zip")
+    with _export_lock, connection() as conn:
+        try:
+            # One read snapshot, so every sheet and the version tag agree
+            conn.execute("BEGIN")
+            version = read_data_version(conn)
+            path = _cached_export_path(fmt, version)
+            if os.path.exists(path):
+                return path
+            os.makedirs(EXPORT_DIR, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=EXPORT_DIR, suffix=f".{fmt}.tmp")
+            os.close(fd)
+            try:
+                if fmt == "xlsx":
+                    _write_xlsx(tmp_path, conn)
+                else:
+                    _write_zip(tmp_path, conn)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        except Exception as e:
+            logging.error(f"Full export failed: {str(e)}")
+            raise
+        finally:
+            conn.rollback()
+    _prune_exports(fmt, keep=path)
+    return path
+
+def _prune_exports(fmt, keep):
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        if name.startswith("full_export_") and name.endswith(f".{fmt}") and path != keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+# ------------------ Slice Exports ------------------ #
+# Nightly accounting sync: only the orders in an id or date window are read,
+# and the last exported order id is remembered per job in store_meta.
+SLICE_FORMATS = ("csv", "xlsx", "parquet")
+SLICE_BATCH_ROWS = 10000
+
+def _watermark_key(name):
+    return f"export_watermark:{name}"
+
+def get_export_watermark(name="accounting"):
+    with connection() as conn:
+        row = conn.execute("SELECT value FROM store_meta WHERE key = ?", (_watermark_key(name),)).fetchone()
+        return row[0] if row else 0
+
+def set_export_watermark(order_id, name="accounting"):
+    with connection() as conn:
+        conn.execute(
+            "INSERT INTO store_meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (_watermark_key(name), int(order_id))
+        )
+        conn.commit()
+
+def _slice_condition(after_id, up_to_id, start_date, end_date):
+    # The store-local date range, narrowed by the id window
+    conditions, params = _created_at_conditions(start_date, end_date)
+    if after_id is not None:
+        conditions.append("o.id > ?")
+        params.append(int(after_id))
+    if up_to_id is not None:
+        conditions.append("o.id <= ?")
+        params.append(int(up_to_id))
+    return " AND ".join(conditions) or "1", params
+
+def _slice_tables(where, params):
+    # (table, [(column, type)], query); the types fix the Parquet schema up front
+    return [
+        ("orders", [("id", "int"), ("timestamp", "text"), ("created_at", "int"), ("total", "float"),
+                    ("camper_name", "text")], f"""
+            SELECT o.id, o.timestamp, o.created_at,
+                   {_ORDER_TOTAL},
+                   o.camper_name
+            FROM orders o WHERE {where} ORDER BY o.id
+        """),
+        ("order_items", [("id", "int"), ("order_id", "int"), ("product_id", "int"), ("name", "text"), ("size", "text"),
+                         ("price", "float"), ("quantity", "int"), ("line_total", "float")], f"""
+            SELECT i.id, i.order_id, i.product_id, i.name, i.size, i.price, i.quantity, i.price * i.quantity
+            FROM orders o JOIN order_items i ON i.order_id = o.id
+            WHERE {where} ORDER BY o.id, i.id
+        """),
+        # Stock movement caused by the sales in this slice, next to the current stock level
+        ("inventory_deltas", [("product_id", "int"), ("name", "text"), ("size", "text"), ("quantity_delta", "int"),
+                              ("revenue", "float"), ("current_stock", "int")], f"""
+            SELECT i.product_id, i.name, i.size, -SUM(i.quantity), SUM(i.price * i.quantity), p.quantity
+            FROM orders o JOIN order_items i ON i.order_id = o.id
+            LEFT JOIN products p ON p.id = i.product_id
+            WHERE {where} GROUP BY i.product_id ORDER BY i.product_id
+        """),
+    ]
+
+def _write_table(path, fmt, columns, rows):
+    header = [name for name, _ in columns]
+    if fmt == "csv":
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+    elif fmt == "xlsx":
+        from openpyxl import Workbook
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet(os.path.splitext(os.path.basename(path))[0][:31])
+        sheet.append(header)
+        for row in rows:
+            sheet.append(list(row))
+        workbook.save(path)
+    elif fmt == "parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet export needs the pyarrow package.")
+        # One declared schema, so a batch of all-NULL or integral prices can't change a column's type
+        types = {"int": pa.int64(), "float": pa.float64(), "text": pa.string()}
+        schema = pa.schema([(name, types[kind]) for name, kind in columns])
+        with pq.ParquetWriter(path, schema) as writer:
+            while True:
+                batch = rows.fetchmany(SLICE_BATCH_ROWS)
+                if not batch:
+                    break
+                arrays = []
+                for (name, kind), values in zip(columns, zip(*batch)):
+                    if kind == "text":
+                        values = [None if value is None else str(value) for value in values]
+                    arrays.append(pa.array(values, type=types[kind]))
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+    else:
+        raise ValueError(f"Unknown export format {fmt!r}; use one of {', '.join(SLICE_FORMATS)}.")
+
+def export_slice(out_dir, fmt="csv", after_id=None, up_to_id=None, start_date=None, end_date=None):
+    # Writes orders, order_items and inventory_deltas for the window; returns a summary dict
+    if fmt not in SLICE_FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}; use one of {', '.join(SLICE_FORMATS)}.")
+    where, params = _slice_condition(after_id, up_to_id, start_date, end_date)
+    os.makedirs(out_dir, exist_ok=True)
+    with connection() as conn:
+        try:
+            conn.execute("BEGIN")
+            first_id, last_id, count = conn.execute(
+                f"SELECT MIN(o.id), MAX(o.id), COUNT(*) FROM orders o WHERE {where}", params
+            ).fetchone()
+            label = f"{first_id}-{last_id}" if count else "empty"
+            files = []
+            for name, columns, sql in _slice_tables(where, params):
+                path = os.path.join(out_dir, f"{name}_{label}.{fmt}")
+                _write_table(path, fmt, columns, conn.execute(sql, params))
+                files.append(path)
+        except Exception as e:
+            logging.error(f"Slice export failed: {str(e)}")
+            raise
+        finally:
+            conn.rollback()
+    return {"orders": count, "first_id": first_id, "last_id": last_id, "files": files}
+
+def export_since_watermark(out_dir, fmt="csv", name="accounting"):
+    # Exports every order after the stored watermark, then advances it
+    after_id = get_export_watermark(name)
+    with connection() as conn:
+        up_to_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM orders").fetchone()[0]
+    result = export_slice(out_dir, fmt, after_id=after_id, up_to_id=up_to_id)
+    if result["orders"]:
+        set_export_watermark(result["last_id"], name)
+    result["watermark"] = result["last_id"] if result["orders"] else after_id
+    return result
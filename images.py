@@ -0,0 +1,127 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+
+IMAGE_DIR = os.path.join("data", "images")
+THUMB_DIR = os.path.join("data", "thumbnails")
+PLACEHOLDER_IMAGE = "placeholder.jpg"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+THUMB_SIZE = (320, 320)
+THUMB_QUALITY = 80
+THUMB_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+_thumb_lock = threading.Lock()
+_digests = {}  # (path, mtime_ns, size) -> content digest of the original
+
+def product_slug(name):
+    return re.sub(r"[^a-z0-9]+", "-", str(name).lower()).strip("-")
+
+def image_for_product(name):
+    # data/images/<slug>.<ext>, falling back to the placeholder
+    slug = product_slug(name)
+    for ext in IMAGE_EXTENSIONS:
+        path = os.path.join(IMAGE_DIR, slug + ext)
+        if os.path.isfile(path):
+            return path
+    return os.path.join(IMAGE_DIR, PLACEHOLDER_IMAGE)
+
+def _thumb_format():
+    from PIL import features
+    return ("WEBP", ".webp") if features.check("webp") else ("JPEG", ".jpg")
+
+def _content_digest(path):
+    # Hash the original once per (mtime, size); large originals aren't re-read on every rerun
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    digest = _digests.get(key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        digest = _digests[key] = h.hexdigest()
+    return digest
+
+def _render_thumbnail(source, target, fmt):
+    from PIL import Image, ImageOps
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail(THUMB_SIZE)
+        if img.mode not in ("RGB", "RGBA") or (fmt == "JPEG" and img.mode == "RGBA"):
+            img = img.convert("RGB")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                img.save(tmp, fmt, quality=THUMB_QUALITY)
+            os.replace(tmp_path, target)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+def _evict_thumbnails(max_bytes=THUMB_CACHE_MAX_BYTES):
+    # Least recently used first; a cache hit refreshes the file's mtime
+    entries = []
+    for root, _, files in os.walk(THUMB_DIR):
+        for file_name in files:
+            path = os.path.join(root, file_name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+
+def thumbnail_for_image(path):
+    # Content-addressed thumbnail path, generated on first request
+    fmt, ext = _thumb_format()
+    digest = hashlib.sha256(f"{_content_digest(path)}:{THUMB_SIZE}:{fmt}:{THUMB_QUALITY}".encode()).hexdigest()
+    target = os.path.join(THUMB_DIR, digest[:2], digest + ext)
+    with _thumb_lock:
+        if os.path.isfile(target):
+            os.utime(target)
+            return target
+        _render_thumbnail(path, target, fmt)
+        _evict_thumbnails()
+    return target
+
+def product_thumbnail(name):
+    # Thumbnail for a product card; falls back to the placeholder, then to the original
+    path = image_for_product(name)
+    try:
+        return thumbnail_for_image(path)
+    except Exception as e:
+        logging.error(f"Thumbnail failed for {path}: {str(e)}")
+        placeholder = os.path.join(IMAGE_DIR, PLACEHOLDER_IMAGE)
+        if path != placeholder:
+            try:
+                return thumbnail_for_image(placeholder)
+            except Exception:
+                pass
+        return placeholder
+
+def save_product_image(name, uploaded_file):
+    # Stores an uploaded image as the product's original and builds its thumbnail up front
+    from PIL import Image
+    uploaded_file.seek(0)
+    with Image.open(uploaded_file) as img:
+        img.verify()
+    ext = os.path.splitext(uploaded_file.name)[1].lower()
+    if ext not in IMAGE_EXTENSIONS:
+        raise ValueError(f"Unsupported image type {ext!r}; use one of {', '.join(IMAGE_EXTENSIONS)}.")
+    slug = product_slug(name)
+    os.makedirs(IMAGE_DIR, exist_ok=True)
+    for old_ext in IMAGE_EXTENSIONS:
+        old_path = os.path.join(IMAGE_DIR, slug + old_ext)
+        if old_ext != ext and os.path.isfile(old_path):
+            os.remove(old_path)
+    path = os.path.join(IMAGE_DIR, slug + ext)
+    uploaded_file.seek(0)
+    with open(path, "wb") as f:
+        f.write(uploaded_file.read())
+    return thumbnail_for_image(path)
@@ -0,0 +1,166 @@
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+
+# Process-wide timings for the database layer. Connections made by
+# database.get_connection time every statement, commit and rollback;
+# the pool and checkout writer add their own entries. Percentiles come
+# from the most recent HISTOGRAM_SAMPLES samples of each entry.
+ENABLED = os.environ.get("STORE_INSTRUMENTATION", "1") != "0"
+SLOW_QUERY_MS = float(os.environ.get("STORE_SLOW_QUERY_MS", "200"))
+SLOW_QUERY_LOG = os.environ.get("STORE_SLOW_QUERY_LOG", "slow_queries.log")
+HISTOGRAM_SAMPLES = 2048
+# STORE_PROFILE_STARTUP=1 logs each page's first render in the process and
+# which heavy modules it had loaded by then
+STARTUP_PROFILE = os.environ.get("STORE_PROFILE_STARTUP", "0") == "1"
+HEAVY_MODULES = ("pandas", "numpy", "pyarrow", "openpyxl", "PIL")
+
+_slow_log = logging.getLogger("store.slow")
+_slow_log.propagate = False
+if not _slow_log.handlers:
+    _handler = logging.FileHandler(SLOW_QUERY_LOG, delay=True)
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    _slow_log.addHandler(_handler)
+
+_startup_log = logging.getLogger("store.startup")
+
+_lock = threading.Lock()
+_timings = {}   # name -> [count, total_seconds, max_seconds, rows, recent samples]
+_counters = {}
+_rendered_pages = set()
+
+def record(name, seconds, rows=None):
+    with _lock:
+        entry = _timings.get(name)
+        if entry is None:
+            entry = _timings[name] = [0, 0.0, 0.0, 0, deque(maxlen=HISTOGRAM_SAMPLES)]
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+        if rows is not None and rows > 0:
+            entry[3] += rows
+        entry[4].append(seconds)
+
+def increment(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+@contextmanager
+def timer(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+def page_rendered(page, started):
+    # Called at the end of a page script with the perf_counter() read at its top;
+    # the first run of each page in a process is its cold render
+    elapsed = time.perf_counter() - started
+    record(f"page render: {page}", elapsed)
+    with _lock:
+        first = page not in _rendered_pages
+        _rendered_pages.add(page)
+    if first:
+        record(f"first render: {page}", elapsed)
+        if STARTUP_PROFILE:
+            loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+            _startup_log.info(f"first render of {page} took {elapsed * 1000:.0f} ms; "
+                              f"heavy modules loaded: {', '.join(loaded) or 'none'}")
+
+def _percentile(ordered, q):
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+def snapshot():
+    with _lock:
+        timings = {name: (count, total, peak, rows, sorted(samples))
+                   for name, (count, total, peak, rows, samples) in _timings.items()}
+        counters = dict(_counters)
+    rows = []
+    for name, (count, total, peak, touched, ordered) in timings.items():
+        rows.append({
+            "name": name,
+            "count": count,
+            "total_ms": round(total * 1000, 3),
+            "p50_ms": round(_percentile(ordered, 0.50) * 1000, 3),
+            "p95_ms": round(_percentile(ordered, 0.95) * 1000, 3),
+            "p99_ms": round(_percentile(ordered, 0.99) * 1000, 3),
+            "max_ms": round(peak * 1000, 3),
+            "rows": touched,
+        })
+    rows.sort(key=lambda row: row["total_ms"], reverse=True)
+    return {"timings": rows, "counters": counters}
+
+def reset():
+    with _lock:
+        _timings.clear()
+        _counters.clear()
+
+@lru_cache(maxsize=1024)
+def statement_name(sql):
+    # Collapses whitespace and placeholder lists so a statement's variants share one entry
+    text = " ".join(sql.split())
+    text = re.sub(r"\(\?(?:, \?)*\)(?:, \(\?(?:, \?)*\))+", "(?), ...", text)
+    text = re.sub(r"\?(?:, \?){2,}", "?, ...", text)
+    return text if len(text) <= 160 else text[:157] + "..."
+
+def _observe(sql, started, rowcount):
+    elapsed = time.perf_counter() - started
+    name = statement_name(sql)
+    rows = rowcount if rowcount is not None and rowcount >= 0 else None
+    record(name, elapsed, rows)
+    if name.upper().startswith("BEGIN IMMEDIATE"):
+        # Time spent waiting for the write lock
+        record("lock wait (BEGIN IMMEDIATE)", elapsed)
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        _slow_log.warning(f"{elapsed * 1000:.1f} ms rows={rows if rows is not None else '-'} {name}")
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _observe(sql, started, self.rowcount)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _observe(sql, started, self.rowcount)
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            _observe(sql_script, started, None)
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        with timer("commit"):
+            super().commit()
+
+    def rollback(self):
+        with timer("rollback"):
+            super().rollback()
+
+def connection_factory():
+    return InstrumentedConnection if ENABLED else sqlite3.Connection
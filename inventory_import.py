@@ -0,0 +1,129 @@
+import logging
+import pandas as pd
+from database import connection, import_product_rows, product_rows_from_frame
+
+CHUNK_ROWS = 5000  # rows validated and upserted per step
+PREVIEW_ROWS = 50
+REQUIRED_COLUMNS = {"name", "price", "quantity"}
+
+def _is_csv(uploaded_file):
+    return uploaded_file.name.lower().endswith(".csv")
+
+def iter_inventory_chunks(uploaded_file, chunk_rows=CHUNK_ROWS, max_rows=None, usecols=None):
+    # Yields (raw DataFrame chunk, fraction of the file read so far)
+    uploaded_file.seek(0)
+    if _is_csv(uploaded_file):
+        size = getattr(uploaded_file, "size", 0) or 0
+        # Closing the reader detaches its text wrapper; leaving it to the garbage
+        # collector when a caller stops early would close the upload itself
+        with pd.read_csv(uploaded_file, chunksize=chunk_rows, nrows=max_rows, usecols=usecols) as reader:
+            for chunk in reader:
+                yield chunk, (min(uploaded_file.tell() / size, 1.0) if size else 0.0)
+        return
+
+    from openpyxl import load_workbook
+    workbook = load_workbook(uploaded_file, read_only=True, data_only=True)
+    try:
+        sheet = workbook.active
+        total_rows = max((sheet.max_row or 1) - 1, 1)
+        rows = sheet.iter_rows(values_only=True)
+        header = [str(h).strip() if h is not None else "" for h in next(rows, ())]
+        width = len(header)
+        batch = []
+        seen = 0
+        for row in rows:
+            if all(v is None for v in row):
+                continue
+            batch.append(tuple(row[:width]) + (None,) * (width - len(row)))
+            seen += 1
+            if len(batch) >= chunk_rows or seen == max_rows:
+                yield pd.DataFrame(batch, columns=header), min(seen / total_rows, 1.0)
+                batch = []
+            if seen == max_rows:
+                return
+        if batch:
+            yield pd.DataFrame(batch, columns=header), 1.0
+    finally:
+        workbook.close()
+
+def missing_columns(df):
+    return REQUIRED_COLUMNS - set(df.columns)
+
+def has_duplicate_ids(uploaded_file, chunk_rows=CHUNK_ROWS):
+    # Id-only pass so duplicate handling matches a whole-file load
+    seen = set()
+    for chunk, _ in iter_inventory_chunks(uploaded_file, chunk_rows, usecols=lambda col: col == "id"):
+        if "id" not in chunk.columns:
+            return False
+        ids = pd.to_numeric(chunk["id"], errors="coerce").fillna(0).astype(int)
+        if ids.duplicated().any() or not seen.isdisjoint(ids.tolist()):
+            return True
+        seen.update(ids.tolist())
+    return False
+
+def normalize_inventory_chunk(df, state):
+    # state carries id assignment across chunks: next_id and the name/size -> id map
+    missing = missing_columns(df)
+    if missing:
+        raise ValueError(f"Uploaded file must contain columns: {', '.join(sorted(REQUIRED_COLUMNS))}.")
+    df = df.copy()
+    for col in ("category", "size"):
+        df[col] = df[col].fillna("") if col in df.columns else ""
+
+    if "id" not in df.columns:
+        # Auto-generate sequential ids, continuing from the previous chunk
+        df["id"] = range(state["next_id"], state["next_id"] + len(df))
+        state["next_id"] += len(df)
+    elif state["regenerate_ids"]:
+        # Unique numeric ids from name and size, numbered in order of first appearance
+        keys = (df["name"].astype(str) + "_" + df["size"].astype(str)).str.replace(" ", "_")
+        key_ids = state["key_ids"]
+        df["id"] = [key_ids.setdefault(key, len(key_ids) + 1) for key in keys]
+    else:
+        df["id"] = pd.to_numeric(df["id"], errors="coerce").fillna(0).astype(int)
+
+    df["price"] = pd.to_numeric(df["price"], errors="coerce").fillna(0).astype(int)
+    df["quantity"] = pd.to_numeric(df["quantity"], errors="coerce").fillna(0).astype(int)
+    return df
+
+def new_import_state(regenerate_ids=False):
+    return {"next_id": 1, "regenerate_ids": regenerate_ids, "key_ids": {}}
+
+def preview_inventory(uploaded_file, rows=PREVIEW_ROWS):
+    chunk = next((c for c, _ in iter_inventory_chunks(uploaded_file, rows, max_rows=rows)), None)
+    if chunk is None:
+        return pd.DataFrame()
+    if missing_columns(chunk):
+        return chunk
+    return normalize_inventory_chunk(chunk, new_import_state())
+
+def stream_inventory_import(uploaded_file, overwrite=False, on_progress=None, chunk_rows=CHUNK_ROWS):
+    regenerate_ids = has_duplicate_ids(uploaded_file, chunk_rows)
+    state = new_import_state(regenerate_ids)
+    totals = {"inserted": 0, "updated": 0, "unchanged": 0, "rows": 0, "regenerated_ids": regenerate_ids}
+
+    def run():
+        for i, (chunk, fraction) in enumerate(iter_inventory_chunks(uploaded_file, chunk_rows)):
+            chunk = normalize_inventory_chunk(chunk, state)
+            counts = import_product_rows(product_rows_from_frame(chunk), overwrite=overwrite and i == 0)
+            for key in ("inserted", "updated", "unchanged"):
+                totals[key] += counts[key]
+            totals["rows"] += len(chunk)
+            if on_progress:
+                on_progress(fraction, totals)
+
+    if overwrite:
+        # Replacing the catalog must not leave it half-loaded, so hold one transaction
+        with connection() as conn:
+            try:
+                conn.execute("BEGIN IMMEDIATE;")
+                run()
+                conn.commit()
+            except Exception as e:
+                logging.error(f"Inventory import failed: {str(e)}")
+                conn.rollback()
+                raise
+    else:
+        # Upserts are idempotent, so each chunk commits and a failed import can simply be re-run
+        run()
+    return totals
@@ -0,0 +1,57 @@
+import argparse
+import os
+import api
+import database
+from exports import SLICE_FORMATS, export_since_watermark, export_slice
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Store database maintenance commands.")
+    parser.add_argument("--db", default=database.DB_NAME, help="SQLite database file (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rebuild-aggregates", help="Recompute daily, camper and product sales from order history.")
+    export = commands.add_parser("export", help="Export a slice of orders, order items and inventory deltas.")
+    window = export.add_mutually_exclusive_group(required=True)
+    window.add_argument("--since-watermark", metavar="JOB", help="Orders after JOB's last exported order id; advances it.")
+    window.add_argument("--since-id", type=int, metavar="N", help="Orders with id greater than N.")
+    window.add_argument("--from", dest="start_date", metavar="YYYY-MM-DD", help="Orders on or after this date.")
+    export.add_argument("--to", dest="end_date", metavar="YYYY-MM-DD", help="Orders on or before this date.")
+    export.add_argument("--format", default="csv", choices=SLICE_FORMATS)
+    export.add_argument("--out", default=os.path.join("data", "exports", "slices"), help="Output directory.")
+    archive = commands.add_parser("archive", help="Move a closed period's orders into data/archives/NAME.db.")
+    archive.add_argument("name", help="Archive name, e.g. summer-session-1")
+    archive.add_argument("--through", required=True, metavar="YYYY-MM-DD", help="Last order date to archive.")
+    archive.add_argument("--from", dest="start_date", metavar="YYYY-MM-DD", help="First order date to archive.")
+    archive.add_argument("--vacuum", action="store_true", help="Shrink store.db afterwards.")
+    commands.add_parser("list-archives", help="Show the archived periods.")
+    serve = commands.add_parser("serve-api", help="Run the local JSON API for tills.")
+    serve.add_argument("--host", default=api.DEFAULT_HOST)
+    serve.add_argument("--port", type=int, default=api.DEFAULT_PORT)
+    args = parser.parse_args(argv)
+
+    database.DB_NAME = args.db
+    database.init_db()
+    if args.command == "rebuild-aggregates":
+        database.rebuild_sales_aggregates()
+        print(f"Rebuilt sales aggregates for {len(database.get_daily_sales())} days.")
+    elif args.command == "export":
+        if args.since_watermark:
+            result = export_since_watermark(args.out, args.format, name=args.since_watermark)
+        else:
+            result = export_slice(args.out, args.format, after_id=args.since_id,
+                                  start_date=args.start_date, end_date=args.end_date)
+        print(f"Exported {result['orders']} orders to {args.out}")
+        for path in result["files"]:
+            print(f"  {path}")
+    elif args.command == "archive":
+        moved = database.archive_orders(args.name, args.through, start_date=args.start_date, vacuum=args.vacuum)
+        print(f"Archived {moved} orders into {args.name}.")
+    elif args.command == "list-archives":
+        for entry in database.list_archives():
+            print(f"{entry['name']}: orders {entry['first_id']}-{entry['last_id']} ({entry['order_count']}), "
+                  f"{entry['first_timestamp']} to {entry['last_timestamp']}")
+    elif args.command == "serve-api":
+        print(f"Serving {args.db} on http://{args.host}:{args.port}")
+        api.serve(args.host, args.port)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
+import time
+RENDER_STARTED = time.perf_counter()
 import streamlit as st
-import pandas as pd
-from database import get_connection, init_db
+import instrumentation
+from database import connection, init_db, bump_catalog_version, get_catalog
+from images import IMAGE_EXTENSIONS, image_for_product, product_thumbnail, save_product_image
 
 st.set_page_config(page_title="Admin Upload", layout="wide")
 init_db()
@@ -8,77 +11,74 @@ init_db()
 def upload_inventory():
     st.header("Upload Inventory")
     uploaded_file = st.file_uploader("Excel or CSV", type=["xlsx", "csv"])
-    conn = get_connection()
-    existing_count = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+    # Counted from the cached catalog; a connection is only opened to clear
+    existing_count = len(get_catalog()["products"])
 
     if existing_count > 0:
         if st.button("Clear and Replace Data"):
-            c = conn.cursor()
-            c.execute("DELETE FROM products")
-            c.execute("DELETE FROM sqlite_sequence WHERE name='products'")  # Reset auto-increment
-            conn.commit()
+            with connection() as conn:
+                c = conn.cursor()
+                c.execute("DELETE FROM products")
+                c.execute("DELETE FROM sqlite_sequence WHERE name='products'")  # Reset auto-increment
+                bump_catalog_version(c)
+                conn.commit()
             st.success("All existing data has been cleared. Please upload new data.")
             st.rerun()  # Replaced experimental_rerun
 
     if uploaded_file:
+        # Imported here so pandas only loads once there is a file to read
+        from inventory_import import missing_columns, preview_inventory, stream_inventory_import
         try:
-            if uploaded_file.name.lower().endswith(".csv"):
-                df = pd.read_csv(uploaded_file)
-            else:
-                df = pd.read_excel(uploaded_file)
-
-            # Validate required columns
-            required_columns = {"name", "price", "quantity"}
-            if not all(col in df.columns for col in required_columns):
+            # Only the first rows are parsed for the preview; the import streams the rest
+            preview = preview_inventory(uploaded_file)
+            if missing_columns(preview):
                 st.error("Uploaded file must contain columns: name, price, quantity.")
                 return
 
-            # Ensure id column exists or generate unique ids
-            if "id" not in df.columns:
-                df["id"] = range(1, len(df) + 1)  # Auto-generate sequential ids
-            else:
-                df["id"] = pd.to_numeric(df["id"], errors="coerce").fillna(0).astype(int)
-                if df["id"].duplicated().any():
-                    st.warning("Duplicate ids detected. Generating unique ids based on name and size.")
-                    df["temp_id"] = df.apply(lambda row: f"{row['name']}_{row.get('size', '')}".replace(" ", "_"), axis=1)
-                    df["id"] = pd.factorize(df["temp_id"])[0] + 1  # Unique numeric ids starting from 1
-
-            # Convert columns to appropriate types and handle NaN
-            df["price"] = pd.to_numeric(df["price"], errors="coerce").fillna(0).astype(int)
-            df["quantity"] = pd.to_numeric(df["quantity"], errors="coerce").fillna(0).astype(int)
-            df["category"] = df["category"].fillna("")
-            df["size"] = df["size"].fillna("")
-
-            st.dataframe(df)
+            st.caption(f"Preview of the first {len(preview)} rows")
+            st.dataframe(preview)
 
             overwrite = st.checkbox("Overwrite existing products?", value=False, disabled=(existing_count == 0))
             if st.button("Upload to Database"):
-                c = conn.cursor()
                 if existing_count > 0 and not overwrite:
                     st.warning("Products exist; enable overwrite to replace.")
                 else:
-                    if overwrite or existing_count == 0:
-                        c.execute("DELETE FROM products")
-                        c.execute("DELETE FROM sqlite_sequence WHERE name='products'")  # Reset auto-increment
-                    for _, row in df.iterrows():
-                        c.execute("""
-                            INSERT INTO products (id, name, category, size, price, quantity)
-                            VALUES (?, ?, ?, ?, ?, ?)
-                        """, (
-                            row["id"],
-                            row["name"],
-                            row["category"],
-                            row["size"],
-                            row["price"],
-                            row["quantity"]
-                        ))
-                    conn.commit()
-                    st.success("Inventory uploaded successfully.")
+                    progress = st.progress(0.0, text="Importing...")
+                    counts = stream_inventory_import(
+                        uploaded_file,
+                        overwrite=overwrite,
+                        on_progress=lambda fraction, totals: progress.progress(
+                            fraction, text=f"Imported {totals['rows']} rows..."
+                        ),
+                    )
+                    progress.progress(1.0, text=f"Imported {counts['rows']} rows.")
+                    if counts["regenerated_ids"]:
+                        st.warning("Duplicate ids detected. Generated unique ids based on name and size.")
+                    st.success(
+                        f"Inventory uploaded successfully: {counts['inserted']} inserted, "
+                        f"{counts['updated']} updated, {counts['unchanged']} unchanged."
+                    )
+        except Exception as e:
+            st.error(f"An error occurred: {str(e)}")
+
+def upload_product_images():
+    st.header("Product Images")
+    names = [view["name"] for view in get_catalog()["views"]]
+    if not names:
+        st.info("Upload inventory before adding product images.")
+        return
+    name = st.selectbox("Product", names, key="image_product")
+    st.caption(f"Current image: {image_for_product(name)}")
+    st.image(product_thumbnail(name))
+    image_file = st.file_uploader("Image", type=[ext.lstrip(".") for ext in IMAGE_EXTENSIONS], key="image_upload")
+    if image_file and st.button("Save Image"):
+        try:
+            save_product_image(name, image_file)
+            st.success(f"Saved image for {name}.")
         except Exception as e:
             st.error(f"An error occurred: {str(e)}")
-        finally:
-            conn.close()
-    else:
-        conn.close()
 
 upload_inventory()
+upload_product_images()
+
+instrumentation.page_rendered("Admin", RENDER_STARTED)
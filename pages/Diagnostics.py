@@ -0,0 +1,46 @@
+import streamlit as st
+import pandas as pd
+import instrumentation
+from database import init_db, pool_stats
+
+st.set_page_config(page_title="Diagnostics", layout="wide")
+st.title("Database Diagnostics")
+init_db()
+
+st.caption(
+    f"Timings for this server process. Statements slower than {instrumentation.SLOW_QUERY_MS:g} ms "
+    f"are logged to {instrumentation.SLOW_QUERY_LOG} (STORE_SLOW_QUERY_MS)."
+)
+if not instrumentation.ENABLED:
+    st.warning("Instrumentation is off (STORE_INSTRUMENTATION=0).")
+
+@st.fragment(run_every="5s")
+def live_metrics():
+    snapshot = instrumentation.snapshot()
+    counters = snapshot["counters"]
+    stats = pool_stats()
+
+    cols = st.columns(5)
+    cols[0].metric("Checkout orders", counters.get("checkout orders", 0))
+    cols[1].metric("Checkout failures", counters.get("checkout failures", 0))
+    cols[2].metric("Lock retries", counters.get("checkout lock retries", 0))
+    cols[3].metric("Pool size / idle", f"{stats['size']} / {stats['idle']}")
+    cols[4].metric("Pool waits", stats["waits"])
+
+    timings = pd.DataFrame(snapshot["timings"], columns=[
+        "name", "count", "total_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms", "rows"
+    ])
+    st.subheader("Latency by operation")
+    if not timings.empty:
+        st.dataframe(timings, use_container_width=True, hide_index=True)
+    else:
+        st.info("No database activity recorded yet.")
+
+    st.subheader("Connection pool")
+    st.json(stats)
+
+live_metrics()
+
+if st.button("Reset metrics"):
+    instrumentation.reset()
+    st.rerun()
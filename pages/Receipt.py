@@ -1,126 +1,90 @@
+import os
+import time
+RENDER_STARTED = time.perf_counter()
 import streamlit as st
 import pandas as pd
-import io
-import zipfile
-from datetime import datetime
-from database import get_connection
-import pytz  # For timezone support
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+import instrumentation
+from database import (
+    ORDER_PAGE_SIZE,
+    STORE_TIMEZONE,
+    get_data_version,
+    get_items_for_orders,
+    get_orders_page,
+    get_sales_by_period,
+    init_db,
+    release_holds,
+    search_orders_by_camper,
+    suggest_camper_names,
+)
+from exports import available_excel_engine, full_export
+from report_service import get_report_snapshot
+from reports import localize_order_times
 
 st.set_page_config(page_title="Receipts", layout="wide")
 st.title("Receipts / Orders")
-
-def available_excel_engine():
-    try:
-        import openpyxl  # noqa: F401
-        return "openpyxl"
-    except ImportError:
-        return None
-
-def make_excel_bytes(dfs: dict):
-    engine = available_excel_engine()
-    if engine is None:
-        return None
-    buf = io.BytesIO()
-    with pd.ExcelWriter(buf, engine=engine) as writer:
-        for name, df in dfs.items():
-            if name == "Orders":
-                # Select id, date, time, total, and camper_name columns
-                df = df[["id", "date", "time", "total", "camper_name"]].copy()
-                df["date"] = pd.to_datetime(df["date"]).dt.strftime("%Y-%m-%d")
-                df["time"] = df["time"]  # Already in EEST format
-                df["total"] = df["total"].round(2)  # Ensure total is formatted with 2 decimals
-            elif name == "Combined Receipts":
-                # Custom formatting for Combined Receipts
-                df = df.copy()
-            df.to_excel(writer, index=False, sheet_name=name[:31])
-    buf.seek(0)
-    return buf
-
-def make_zip_bytes(files: dict):
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as z:
-        for fname, content in files.items():
-            z.writestr(fname, content)
-    buf.seek(0)
-    return buf
-
-# Load data
-conn = get_connection()
-orders_df = pd.read_sql_query("SELECT * FROM orders ORDER BY id DESC", conn)
-order_items_df = pd.read_sql_query("SELECT * FROM order_items ORDER BY order_id DESC", conn)
-products_df = pd.read_sql_query("SELECT * FROM products ORDER BY id", conn)
-conn.close()
-
-# Normalize and compute line totals
-order_items_df["price"] = pd.to_numeric(order_items_df["price"], errors="coerce").fillna(0.0)
-order_items_df["quantity"] = pd.to_numeric(order_items_df["quantity"], errors="coerce").fillna(0).astype(int)
-order_items_df["line_total"] = order_items_df["price"] * order_items_df["quantity"]
-
-# Recalculate order totals from items when needed
-recalc = (
-    order_items_df.groupby("order_id", as_index=False)["line_total"]
-    .sum()
-    .rename(columns={"order_id": "id", "line_total": "total_from_items"})
-)
-orders_df["total"] = pd.to_numeric(orders_df.get("total", 0), errors="coerce").fillna(0.0)
-orders_df = orders_df.merge(recalc, on="id", how="left")
-orders_df["total"] = orders_df["total_from_items"].where(
-    orders_df["total_from_items"].notna() & (orders_df["total_from_items"] != 0),
-    orders_df["total"]
-)
-orders_df.drop(columns=["total_from_items"], inplace=True)
-
-# Parse timestamp with Egyptian time (EEST, UTC+3)
-eest = pytz.timezone("Africa/Cairo")
-orders_df["parsed_ts"] = pd.to_datetime(orders_df.get("timestamp", ""), utc=True).dt.tz_convert(eest) if "timestamp" in orders_df else pd.NaT
-orders_df["date"] = orders_df["parsed_ts"].dt.date
-orders_df["time"] = orders_df["parsed_ts"].dt.strftime("%H:%M:%S")
-
-# Prepare Combined Receipts data
-combined_receipts_data = []
-for order_id in orders_df["id"].unique():
-    order_row = orders_df[orders_df["id"] == order_id].iloc[0]
-    combined_receipts_data.append(["Header", "Order ID", order_id])
-    combined_receipts_data.append(["Header", "Timestamp", order_row["parsed_ts"].strftime("%Y-%m-%d %H:%M:%S")])
-    combined_receipts_data.append(["Header", "Total", f"{order_row['total']:.2f} EGP"])
-    combined_receipts_data.append(["Header", "Camper Name", order_row.get("camper_name", "N/A")])  # Add camper name
-    combined_receipts_data.append(["Items", "", ""])  # Separator for items
-    items = order_items_df[order_items_df["order_id"] == order_id]
-    for _, item in items.iterrows():
-        combined_receipts_data.append(["Items", item["name"], f"{item['quantity']} x {item['price']:.2f} = {item['line_total']:.2f}"])
-
-# Create DataFrame for Combined Receipts
-combined_receipts_df = pd.DataFrame(combined_receipts_data, columns=["Section", "Field", "Value"])
-
-# Prepare Camper Summary data with items
-camper_summary_data = []
-camper_groups = orders_df.groupby("camper_name")
-for camper_name, group in camper_groups:
-    total_paid = group["total"].sum().round(2)
-    order_ids = ", ".join(group["id"].astype(str))
-    items_list = []
-    for order_id in group["id"]:
-        order_items = order_items_df[order_items_df["order_id"] == order_id]
-        for _, item in order_items.iterrows():
-            items_list.append(f"{item['name']} ({item['quantity']} x {item['price']:.2f} = {item['line_total']:.2f})")
-    items_str = "; ".join(items_list) if items_list else "No items"
-    camper_summary_data.append([camper_name, total_paid, order_ids, items_str])
-
-camper_summary_df = pd.DataFrame(camper_summary_data, columns=["Camper Name", "Total Paid (EGP)", "Order IDs", "Items Ordered"])
-
-# Daily totals
-daily_totals_df = (
-    orders_df.dropna(subset=["date"])
-    .groupby("date", as_index=False)["total"]
-    .sum()
-    .rename(columns={"total": "daily_total"})
-)
-daily_totals_df["daily_total"] = daily_totals_df["daily_total"].round(2)
+init_db()
+
+# Summaries are built in the background whenever the data changes; the page
+# only reads the latest finished snapshot
+report_snapshot, report_stale = get_report_snapshot(wait=True, timeout=60)
+report_frames = report_snapshot["frames"] if report_snapshot else {}
+empty = pd.DataFrame()
+daily_totals_df = report_frames.get("daily_totals", empty)
+camper_totals_df = report_frames.get("camper_totals", empty)
+product_sales_df = report_frames.get("product_sales", empty)
+camper_summary_df = report_frames.get("camper_summary", empty)
 
 # Display
 st.subheader("All Orders")
-st.dataframe(orders_df[["id", "date", "time", "total", "camper_name"]], use_container_width=True)
+filter_cols = st.columns(5)
+with filter_cols[0]:
+    start_date = st.date_input("From", value=None, key="orders_from")
+with filter_cols[1]:
+    end_date = st.date_input("To", value=None, key="orders_to")
+with filter_cols[2]:
+    camper_filter = st.text_input("Camper", key="orders_camper").strip()
+with filter_cols[3]:
+    min_total = st.number_input("Min total", value=None, min_value=0.0, key="orders_min_total")
+with filter_cols[4]:
+    max_total = st.number_input("Max total", value=None, min_value=0.0, key="orders_max_total")
+include_archived = st.checkbox("Include archived orders", key="orders_archived")
+order_filters = {
+    "include_archived": include_archived,
+    "start_date": start_date,
+    "end_date": end_date,
+    "camper_name": camper_filter or None,
+    "min_total": min_total,
+    "max_total": max_total,
+}
 
+# Keyset cursors of the pages visited so far; changing a filter starts over
+if st.session_state.get("order_filters") != order_filters:
+    st.session_state.order_filters = order_filters
+    st.session_state.order_page_cursors = [None]
+page_cursors = st.session_state.order_page_cursors
+page_rows, next_before_id = get_orders_page(ORDER_PAGE_SIZE, page_cursors[-1], **order_filters)
+page_df = localize_order_times(pd.DataFrame(page_rows, columns=["id", "timestamp", "created_at", "total", "camper_name"]))
+if not page_df.empty:
+    st.dataframe(page_df[["id", "date", "time", "total", "camper_name"]], use_container_width=True)
+else:
+    st.info("No orders match these filters.")
+
+nav_prev, nav_page, nav_next = st.columns([1, 2, 1])
+with nav_prev:
+    if st.button("◀ Newer", disabled=len(page_cursors) == 1):
+        page_cursors.pop()
+        st.rerun()
+with nav_page:
+    st.markdown(f"Page {len(page_cursors)}")
+with nav_next:
+    if st.button("Older ▶", disabled=next_before_id is None):
+        page_cursors.append(next_before_id)
+        st.rerun()
+
+if report_snapshot:
+    st.caption(f"Summaries as of {report_snapshot['built_at']}" + (" — updating..." if report_stale else ""))
 st.subheader("Daily Sales Summary")
 if not daily_totals_df.empty:
     st.dataframe(daily_totals_df, use_container_width=True)
@@ -128,33 +92,81 @@ if not daily_totals_df.empty:
 else:
     st.info("No sales data.")
 
+st.subheader("Sales by Period")
+period_cols = st.columns(3)
+store_today = datetime.now(ZoneInfo(STORE_TIMEZONE)).date()
+with period_cols[0]:
+    period_from = st.date_input("From", value=store_today - timedelta(days=6), key="period_from")
+with period_cols[1]:
+    period_to = st.date_input("To", value=store_today, key="period_to")
+with period_cols[2]:
+    period = st.radio("Group by", ["day", "week", "session"], horizontal=True, key="period_kind")
+if period_from and period_to and period_from <= period_to:
+    period_df = pd.DataFrame(
+        get_sales_by_period(period_from, period_to, period, include_archived=include_archived),
+        columns=["period", "start", "end", "order_count", "total"]
+    )
+    st.dataframe(period_df[["period", "order_count", "total"]], use_container_width=True, hide_index=True)
+else:
+    st.info("Choose a date range to see sales by period.")
+
+st.subheader("Camper Totals")
+if not camper_totals_df.empty:
+    st.dataframe(camper_totals_df, use_container_width=True)
+    with st.expander("Items ordered per camper"):
+        st.dataframe(camper_summary_df, use_container_width=True)
+else:
+    st.info("No camper data.")
+
+st.subheader("Product Sales")
+if not product_sales_df.empty:
+    st.dataframe(product_sales_df, use_container_width=True)
+else:
+    st.info("No product sales.")
+
 st.subheader("Search by Camper Name")
 camper_search = st.text_input("Enter Camper Name:", key="camper_search")
+
+def use_camper_suggestion(name):
+    st.session_state.camper_search = name
+
 if camper_search:
-    filtered_orders = orders_df[orders_df["camper_name"].str.contains(camper_search, case=False, na=False)]
-    if not filtered_orders.empty:
+    suggestions = [name for name in suggest_camper_names(camper_search) if name != camper_search]
+    if suggestions:
+        suggestion_cols = st.columns(len(suggestions))
+        for col, name in zip(suggestion_cols, suggestions):
+            col.button(name, key=f"camper_suggestion_{name}", on_click=use_camper_suggestion, args=(name,))
+
+    matches = search_orders_by_camper(camper_search)
+    if matches:
+        filtered_orders = localize_order_times(
+            pd.DataFrame(matches, columns=["id", "timestamp", "created_at", "total", "camper_name"])
+        )
         st.subheader(f"Orders for Camper: {camper_search}")
-        st.dataframe(filtered_orders[["id", "date", "time", "total"]], use_container_width=True)
-        for order_id in filtered_orders["id"]:
-            items_df = order_items_df[order_items_df["order_id"] == order_id].copy()
+        st.dataframe(filtered_orders[["id", "date", "time", "total", "camper_name"]], use_container_width=True)
+        for order in matches:
+            items_df = pd.DataFrame(order["items"], columns=["product_id", "name", "size", "price", "quantity"])
             if not items_df.empty:
                 items_df["line_total"] = items_df["price"] * items_df["quantity"]
-                st.subheader(f"Items for Order {order_id}")
+                st.subheader(f"Items for Order {order['id']}")
                 st.dataframe(items_df[["name", "size", "price", "quantity", "line_total"]], use_container_width=True)
             else:
-                st.warning(f"No items found for Order {order_id}")
+                st.warning(f"No items found for Order {order['id']}")
     else:
         st.warning(f"No orders found for camper: {camper_search}")
 else:
     st.info("Enter a camper name to search for their orders.")
 
 st.subheader("Inspect Order")
-if not orders_df.empty:
-    selected = st.selectbox("Order ID", orders_df["id"].tolist())
-    order_row = orders_df[orders_df["id"] == selected].iloc[0]
+if not page_df.empty:
+    selected = st.selectbox("Order ID", page_df["id"].tolist())
+    order_row = page_df[page_df["id"] == selected].iloc[0]
     st.markdown(f"**Order {selected}** — Total: {order_row['total']:.2f} EGP — {order_row['parsed_ts'].strftime('%Y-%m-%d %H:%M:%S %Z')}")
     st.markdown(f"**Camper Name:** {order_row.get('camper_name', 'N/A')}")
-    items_df = order_items_df[order_items_df["order_id"] == selected].copy()
+    items_df = pd.DataFrame(
+        get_items_for_orders([selected], include_archived=include_archived),
+        columns=["order_id", "product_id", "name", "size", "price", "quantity"]
+    )
     if not items_df.empty:
         items_df["line_total"] = items_df["price"] * items_df["quantity"]
         st.dataframe(
@@ -177,6 +189,9 @@ if not orders_df.empty:
                     new_cart[item["id"]]["quantity"] += item["quantity"]
                 else:
                     new_cart[item["id"]] = item
+            if "session_id" in st.session_state:
+                # The replaced cart's holds would otherwise block stock until they expire
+                release_holds(st.session_state.session_id)
             st.session_state.cart = new_cart
             st.success("Loaded order into cart. Go to POS page to checkout.")
     else:
@@ -185,33 +200,37 @@ if not orders_df.empty:
 # Full export
 st.markdown("---")
 st.subheader("Full Export")
-combined = {
-    "Orders": orders_df,
-    "OrderItems": order_items_df,
-    "Inventory": products_df,
-    "DailyTotals": daily_totals_df,
-    "Combined Receipts": combined_receipts_df,
-    "Camper Summary": camper_summary_df
-}
-excel = make_excel_bytes(combined)
-if excel:
-    st.download_button(
-        "Download Full Export (.xlsx)",
-        data=excel,
-        file_name=f"full_export_{datetime.now(pytz.timezone('Africa/Cairo')).strftime('%Y%m%d_%H%M%S')}.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
-else:
-    files = {
-        "orders.csv": orders_df.to_csv(index=False).encode(),
-        "order_items.csv": order_items_df.to_csv(index=False).encode(),
-        "inventory.csv": products_df.to_csv(index=False).encode(),
-        "daily_totals.csv": daily_totals_df.to_csv(index=False).encode(),
-    }
-    zipb = make_zip_bytes(files)
-    st.download_button(
-        "Download Full Export (ZIP)",
-        data=zipb,
-        file_name=f"full_export_{datetime.now(pytz.timezone('Africa/Cairo')).strftime('%Y%m%d_%H%M%S')}.zip",
-        mime="application/zip"
-    )
+# Built only when the button is clicked; the result is remembered with its data version
+export_format = "xlsx" if available_excel_engine() else "zip"
+if st.button("Prepare Full Export"):
+    with st.spinner("Building export..."):
+        st.session_state.full_export = {
+            "path": full_export(export_format),
+            "format": export_format,
+            "version": get_data_version(),
+            "stamp": datetime.now(ZoneInfo(STORE_TIMEZONE)).strftime('%Y%m%d_%H%M%S'),
+        }
+prepared = st.session_state.get("full_export")
+if prepared and not os.path.exists(prepared["path"]):
+    # A newer export replaced it on disk
+    prepared = st.session_state.full_export = None
+if prepared:
+    if prepared["version"] != get_data_version():
+        st.caption("Orders or products changed since this export was prepared; prepare it again to include them.")
+    with open(prepared["path"], "rb") as export_file:
+        if prepared["format"] == "xlsx":
+            st.download_button(
+                "Download Full Export (.xlsx)",
+                data=export_file,
+                file_name=f"full_export_{prepared['stamp']}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+        else:
+            st.download_button(
+                "Download Full Export (ZIP)",
+                data=export_file,
+                file_name=f"full_export_{prepared['stamp']}.zip",
+                mime="application/zip"
+            )
+
+instrumentation.page_rendered("Receipts", RENDER_STARTED)
@@ -0,0 +1,135 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+import pandas as pd
+import database
+from exports import CAMPER_SUMMARY_COLUMNS, camper_summary_rows
+
+# Receipts summaries are built off the page, in one background thread, when
+# the store's data version moves. The page reads the latest finished
+# snapshot, which is also kept on disk so a restart has something to show.
+REPORT_DIR = os.path.join("data", "reports")
+REPORT_MIN_INTERVAL = 10  # seconds between rebuilds while orders keep arriving
+SNAPSHOT_FILE = "report_snapshot.pkl"
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+_rebuild_wanted = threading.Event()
+_built = threading.Condition(_snapshot_lock)
+_worker = None
+_worker_lock = threading.Lock()
+
+def _snapshot_path():
+    return os.path.join(REPORT_DIR, SNAPSHOT_FILE)
+
+def _read_frames(conn):
+    daily = pd.DataFrame(
+        conn.execute("SELECT day, order_count, total FROM daily_sales ORDER BY day").fetchall(),
+        columns=["date", "orders", "daily_total"]
+    )
+    daily["daily_total"] = daily["daily_total"].round(2)
+    campers = pd.DataFrame(
+        conn.execute("SELECT camper_name, order_count, total FROM camper_totals ORDER BY camper_name").fetchall(),
+        columns=["camper_name", "order_count", "total"]
+    )
+    products = pd.DataFrame(
+        conn.execute(
+            "SELECT product_id, name, size, quantity, revenue FROM product_sales ORDER BY revenue DESC"
+        ).fetchall(),
+        columns=["product_id", "name", "size", "quantity", "revenue"]
+    )
+    camper_summary = pd.DataFrame(camper_summary_rows(conn).fetchall(), columns=CAMPER_SUMMARY_COLUMNS)
+    return {
+        "daily_totals": daily,
+        "camper_totals": campers,
+        "product_sales": products,
+        "camper_summary": camper_summary,
+    }
+
+def build_snapshot():
+    # Every frame comes from the same read transaction as the version it is tagged with
+    with database.connection() as conn:
+        conn.execute("BEGIN")
+        try:
+            version = database.read_data_version(conn)
+            frames = _read_frames(conn)
+        finally:
+            conn.rollback()
+    return {
+        "db_name": os.path.abspath(database.DB_NAME),
+        "version": version,
+        "built_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "frames": frames,
+    }
+
+def _save(snapshot):
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=REPORT_DIR, suffix=".tmp")
+    os.close(fd)
+    try:
+        pd.to_pickle(snapshot, tmp_path)
+        os.replace(tmp_path, _snapshot_path())
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+def _load():
+    try:
+        snapshot = pd.read_pickle(_snapshot_path())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable report snapshot: {str(e)}")
+        return None
+    if snapshot.get("db_name") != os.path.abspath(database.DB_NAME):
+        return None
+    return snapshot
+
+def _matches_db(snapshot):
+    return snapshot is not None and snapshot["db_name"] == os.path.abspath(database.DB_NAME)
+
+def _worker_loop():
+    global _snapshot
+    while True:
+        _rebuild_wanted.wait()
+        _rebuild_wanted.clear()
+        started = time.monotonic()
+        try:
+            current = _snapshot
+            if not _matches_db(current) or current["version"] != database.get_data_version():
+                snapshot = build_snapshot()
+                with _built:
+                    _snapshot = snapshot
+                    _built.notify_all()
+                _save(snapshot)
+        except Exception as e:
+            logging.error(f"Building the report snapshot failed: {str(e)}")
+        # Coalesce bursts of checkouts into one rebuild per interval
+        time.sleep(max(0.0, REPORT_MIN_INTERVAL - (time.monotonic() - started)))
+
+def _ensure_worker():
+    global _worker, _snapshot
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            if _snapshot is None:
+                _snapshot = _load()
+            _worker = threading.Thread(target=_worker_loop, name="report-builder", daemon=True)
+            _worker.start()
+
+def get_report_snapshot(wait=False, timeout=None):
+    # Latest finished snapshot, possibly older than the data; a rebuild is queued
+    # when it is. With wait=True, blocks until a snapshot exists at all.
+    _ensure_worker()
+    snapshot = _snapshot if _matches_db(_snapshot) else None
+    stale = snapshot is None or snapshot["version"] != database.get_data_version()
+    if stale:
+        _rebuild_wanted.set()
+    if snapshot is None and wait:
+        with _built:
+            _built.wait_for(lambda: _matches_db(_snapshot), timeout)
+            snapshot = _snapshot if _matches_db(_snapshot) else None
+        stale = snapshot is None or snapshot["version"] != database.get_data_version()
+    return snapshot, stale
@@ -0,0 +1,18 @@
+import pandas as pd
+from database import STORE_TIMEZONE
+
+def localize_order_times(orders_df, tz_name=STORE_TIMEZONE):
+    # created_at is UTC epoch seconds; the text timestamp is already store-local time
+    orders_df = orders_df.copy()
+    if "created_at" in orders_df and orders_df["created_at"].notna().all():
+        orders_df["parsed_ts"] = pd.to_datetime(orders_df["created_at"], unit="s", utc=True).dt.tz_convert(tz_name)
+    elif "timestamp" in orders_df:
+        # Repeated autumn hours resolve to their first (DST) occurrence, like zoneinfo's fold=0
+        orders_df["parsed_ts"] = pd.to_datetime(orders_df["timestamp"]).dt.tz_localize(
+            tz_name, ambiguous=[True] * len(orders_df), nonexistent="shift_forward"
+        )
+    else:
+        orders_df["parsed_ts"] = pd.NaT
+    orders_df["date"] = orders_df["parsed_ts"].dt.date
+    orders_df["time"] = orders_df["parsed_ts"].dt.strftime("%H:%M:%S")
+    return orders_df
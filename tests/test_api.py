@@ -0,0 +1,122 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.client import HTTPConnection
+
+import api
+import database
+
+SHIRT_S = {"id": 1, "name": "Shirt", "size": "S", "price": 100}
+SHIRT_M = {"id": 2, "name": "Shirt", "size": "M", "price": 100}
+CAP = {"id": 3, "name": "Cap", "size": "", "price": 20}
+
+class ApiTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.old_db_name = database.DB_NAME
+        self.server = api.make_server("127.0.0.1", 0, os.path.join(self.tmp, "store.db"))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        database.import_product_rows([
+            (1, "Shirt", "Tops", "S", 100, 5),
+            (2, "Shirt", "Tops", "M", 100, 1),
+            (3, "Cap", "", "", 20, 10),
+        ])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        database.close_pool()
+        database.DB_NAME = self.old_db_name
+        shutil.rmtree(self.tmp)
+
+    def request(self, method, path, body=None, headers=None):
+        conn = HTTPConnection(*self.server.server_address, timeout=30)
+        try:
+            conn.request(method, path, body=None if body is None else json.dumps(body), headers=headers or {})
+            response = conn.getresponse()
+            raw = response.read()
+            return response.status, response.headers, json.loads(raw) if raw else None
+        finally:
+            conn.close()
+
+    def checkout(self, *orders):
+        return self.request("POST", "/checkout", {"orders": list(orders)})
+
+    def test_catalog_revalidates_with_etag(self):
+        status, headers, catalog = self.request("GET", "/catalog")
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["ETag"], f'"{catalog["version"]}"')
+        self.assertEqual(len(catalog["products"]), 3)
+
+        status, _, body = self.request("GET", "/catalog", headers={"If-None-Match": headers["ETag"]})
+        self.assertEqual((status, body), (304, None))
+
+        self.checkout({"cart": [dict(CAP, quantity=1)], "camper_name": "Ali"})
+        status, new_headers, _ = self.request("GET", "/catalog", headers={"If-None-Match": headers["ETag"]})
+        self.assertEqual(status, 200)
+        self.assertNotEqual(new_headers["ETag"], headers["ETag"])
+
+    def test_stock_since_version(self):
+        _, _, catalog = self.request("GET", "/catalog")
+        version = catalog["version"]
+        status, _, changes = self.request("GET", f"/stock?since={version}")
+        self.assertEqual(status, 200)
+        self.assertEqual((changes["changed"], changes["deleted"], changes["reset"]), ([], [], False))
+
+        self.checkout({"cart": [dict(SHIRT_S, quantity=2)], "camper_name": "Ali"})
+        with database.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM products WHERE id = 3")
+            database.bump_catalog_version(conn)
+            conn.commit()
+        _, _, changes = self.request("GET", f"/stock?since={version}")
+        self.assertEqual([(p["id"], p["quantity"]) for p in changes["changed"]], [(1, 3)])
+        self.assertEqual(changes["deleted"], [3])
+        self.assertGreater(changes["version"], version)
+
+        _, _, caught_up = self.request("GET", f"/stock?since={changes['version']}")
+        self.assertEqual((caught_up["changed"], caught_up["deleted"]), ([], []))
+        self.assertTrue(self.request("GET", "/stock?since=1000000")[2]["reset"])
+
+    def test_mixed_checkout_batch(self):
+        status, _, body = self.checkout(
+            {"cart": [dict(SHIRT_S, quantity=2)], "camper_name": "Ali"},
+            {"cart": [dict(SHIRT_S, price=1, quantity=2)], "camper_name": "Cheap"},
+            {"cart": [dict(CAP, id=99, quantity=1)], "camper_name": "Ghost"},
+            {"cart": [dict(SHIRT_M, quantity=3)], "camper_name": "Greedy"},
+            {"cart": [dict(CAP, quantity=2)], "total": 5, "camper_name": "Short"},
+            {"cart": [dict(CAP, quantity=2)], "camper_name": "Bo"},
+        )
+        self.assertEqual(status, 200)
+        results = body["results"]
+        self.assertIn("order_id", results[0])
+        self.assertEqual([result.get("code") for result in results[1:5]],
+                         ["price_changed", "missing", "insufficient_stock", "total_mismatch"])
+        self.assertIn("order_id", results[5])
+
+        _, _, order = self.request("GET", f"/orders/{results[0]['order_id']}")
+        self.assertEqual((order["total"], order["camper_name"]), (200, "Ali"))
+        self.assertEqual([(item["product_id"], item["price"], item["quantity"]) for item in order["items"]], [(1, 100, 2)])
+        stock = {p["id"]: p["quantity"] for p in database.get_products()}
+        self.assertEqual(stock, {1: 3, 2: 1, 3: 8})
+        _, _, page = self.request("GET", "/orders")
+        self.assertEqual([o["camper_name"] for o in page["orders"]], ["Bo", "Ali"])
+
+    def test_malformed_order_rejects_the_request(self):
+        status, _, body = self.checkout(
+            {"cart": [dict(CAP, quantity=1)], "camper_name": "A"},
+            {"cart": [dict(CAP, quantity=1)], "camper_name": {"n": 1}},
+            {"cart": [dict(CAP, quantity=1)], "camper_name": "C"},
+        )
+        self.assertEqual(status, 400)
+        self.assertIn("camper_name", body["error"])
+        status, _, _ = self.checkout({"cart": [dict(CAP, id=2 ** 70, quantity=1)]})
+        self.assertEqual(status, 400)
+        self.assertEqual(self.request("GET", "/orders")[2]["orders"], [])
+        self.assertEqual(self.request("GET", f"/orders/{2 ** 70}")[0], 404)
+
+if __name__ == "__main__":
+    unittest.main()
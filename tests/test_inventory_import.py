@@ -0,0 +1,54 @@
+import gc
+import os
+import shutil
+import tempfile
+import unittest
+
+from streamlit.proto.Common_pb2 import FileURLs
+from streamlit.runtime.uploaded_file_manager import UploadedFile, UploadedFileRec
+
+import database
+import inventory_import
+
+def csv_upload(rows, name="inventory.csv"):
+    lines = ["id,name,category,size,price,quantity"]
+    lines += [f"{product_id},{item},Tops,S,{price},{quantity}" for product_id, item, price, quantity in rows]
+    data = ("\n".join(lines) + "\n").encode("utf-8")
+    return UploadedFile(UploadedFileRec("upload", name, "text/csv", data), FileURLs())
+
+class InventoryImportTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.old_db_name = database.DB_NAME
+        database.DB_NAME = os.path.join(self.tmp, "store.db")
+        database.init_db()
+
+    def tearDown(self):
+        database.close_pool()
+        database.DB_NAME = self.old_db_name
+        shutil.rmtree(self.tmp)
+
+    def test_preview_then_import_same_csv_upload(self):
+        # The Admin page previews and imports one UploadedFile in a single run
+        for count in (3, inventory_import.PREVIEW_ROWS, inventory_import.PREVIEW_ROWS + 1):
+            with self.subTest(rows=count):
+                upload = csv_upload([(i, f"Item {i}", 10 * i, i) for i in range(1, count + 1)])
+                preview = inventory_import.preview_inventory(upload)
+                gc.collect()
+                self.assertEqual(len(preview), min(count, inventory_import.PREVIEW_ROWS))
+
+                totals = inventory_import.stream_inventory_import(upload, overwrite=True, chunk_rows=20)
+                self.assertEqual((totals["rows"], totals["regenerated_ids"]), (count, False))
+                self.assertEqual(len(database.get_products()), count)
+
+    def test_import_csv_with_duplicate_ids(self):
+        upload = csv_upload([(1, "Shirt", 100, 2), (1, "Cap", 20, 3), (2, "Hat", 30, 1)])
+        inventory_import.preview_inventory(upload)
+        gc.collect()
+        totals = inventory_import.stream_inventory_import(upload, chunk_rows=2)
+        self.assertTrue(totals["regenerated_ids"])
+        self.assertEqual(sorted((p["id"], p["name"]) for p in database.get_products()),
+                         [(1, "Shirt"), (2, "Cap"), (3, "Hat")])
+
+if __name__ == "__main__":
+    unittest.main()